@@ -0,0 +1,227 @@
+"""Index set for every hot query of server.py and the two action servers.
+
+table_create.py calls :func:`create_indexes`, :func:`analyze` and
+:func:`explain_report` at the end of an ingest; server.py calls
+:func:`create_missing_indexes` at startup for tables that appeared since
+(Rasa creates ``events`` itself), which builds them in one worker only.
+"""
+import logging
+import os
+import sqlite3
+import time
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; workers then rely on the retries alone
+    fcntl = None
+
+from realstate_bot_calm.actions.query_builder import PropertyQueryBuilder, prepare_connection
+
+logger = logging.getLogger(__name__)
+
+# A first build on a large events table outlasts the pool's busy_timeout
+BUILD_BUSY_TIMEOUT_MS = 60000
+BUILD_ATTEMPTS = 3
+
+# name -> (table, columns)
+INDEXES = {
+    # Rasa tracker store: session list, conversation pages, SSE catch-up
+    'idx_events_type_sender_ts': ('events', 'type_name, sender_id, timestamp'),
+    'idx_events_sender_type_ts': ('events', 'sender_id, type_name, timestamp'),
+    'idx_events_sender_id': ('events', 'sender_id, id'),
+    # Property cards, favorites joins, search filters
+    'idx_prop_data_prop_id': ('prop_data', 'PROP_ID'),
+    'idx_prop_data_price': ('prop_data', 'PRICE_VALUE'),
+    'idx_prop_data_area': ('prop_data', 'AREA_VALUE'),
+    'idx_prop_data_city_price': ('prop_data', 'CITY, PRICE_VALUE'),
+    'idx_prop_data_city_type_bedroom': ('prop_data', 'CITY, PROPERTY_TYPE, BEDROOM_NUM'),
+    'idx_prop_data_locality': ('prop_data', 'LOCALITY'),
+    # Incremental reloads replace one city's rows at a time
+    'idx_prop_data_source_city': ('prop_data', 'source_city'),
+    'idx_dealer_data_prop_id': ('dealer_data', 'PROP_ID'),
+    # Per-session lists, newest first
+    'idx_favorites_session_ts': ('favorites', 'session_id, timestamp'),
+    'idx_scheduled_visits_sender_status': ('scheduled_visits', 'sender_id, status, visit_date, visit_time'),
+    'idx_saved_preferences_sender_action_ts': ('saved_preferences', 'sender_id, action_name, timestamp'),
+}
+
+# (name, sql, params) with representative parameter values
+HOT_QUERIES = [
+    ('sessions', '''
+        SELECT sender_id, MAX(timestamp) AS timestamp, type_name
+        FROM events WHERE type_name = 'session_started'
+        GROUP BY sender_id ORDER BY timestamp DESC, sender_id DESC LIMIT ?''', (100,)),
+    ('conversation page', '''
+        SELECT id, data, timestamp FROM events
+        WHERE sender_id = ? AND type_name IN ('bot', 'user')
+        ORDER BY timestamp DESC, id DESC LIMIT ?''', ('s', 50)),
+    ('event stream catch-up', '''
+        SELECT id, sender_id, type_name, timestamp, data FROM events
+        WHERE sender_id = ? AND id > ? AND type_name IN ('bot', 'user')
+        ORDER BY id''', ('s', 0)),
+    ('property card', 'SELECT * FROM prop_data WHERE PROP_ID = ?', ('p',)),
+    ('property cards', 'SELECT * FROM prop_data WHERE PROP_ID IN (?, ?, ?)', ('p', 'q', 'r')),
+    ('dealer', 'SELECT * FROM dealer_data WHERE PROP_ID = ? LIMIT 1', ('p',)),
+    ('favorites', '''
+        SELECT property_id, filters, timestamp FROM favorites
+        WHERE session_id = ? ORDER BY timestamp DESC''', ('s',)),
+    ('favorites with cards', '''
+        SELECT f.property_id, p.PROP_HEADING FROM favorites f
+        LEFT JOIN prop_data p ON p.PROP_ID = CAST(f.property_id AS TEXT)
+        WHERE f.session_id = ? ORDER BY f.timestamp DESC''', ('s',)),
+    ('saved properties', '''
+        SELECT p.* FROM prop_data p JOIN favorites f ON p.PROP_ID = CAST(f.property_id AS TEXT)
+        WHERE f.session_id = ?''', ('s',)),
+    ('favorite status', '''
+        SELECT property_id FROM favorites
+        WHERE session_id = ? AND property_id IN (?, ?)''', ('s', 'p', 'q')),
+    ('scheduled visits', '''
+        SELECT id, property_id, property_address, visit_date, visit_time, status
+        FROM scheduled_visits WHERE sender_id = ? AND status = 'active'
+        ORDER BY visit_date, visit_time''', ('s',)),
+    ('visit by id', '''
+        SELECT id, property_id, property_address FROM scheduled_visits
+        WHERE id = ? AND sender_id = ? AND status = 'active' ''', (1, 's')),
+    ('current filters', 'SELECT filters FROM current_filters WHERE sender_id = ?', ('s',)),
+    ('legacy filters', '''
+        SELECT data FROM saved_preferences
+        WHERE sender_id = ? AND action_name = ? AND type_name = 'slot'
+        ORDER BY timestamp DESC LIMIT 1''', ('s', 'final_text_filters')),
+]
+
+# Searches as action_search_properties issues them
+HOT_SEARCHES = [
+    ('search city + budget', [
+        {'type': 'CITY', 'value': ['Mumbai']},
+        {'type': 'BUDGET', 'value': {'min': 5000000, 'max': 10000000}},
+    ]),
+    ('search city + type + bedrooms', [
+        {'type': 'CITY', 'value': ['Kolkata East', 'Kolkata South']},
+        {'type': 'PROPERTY_TYPE', 'value': ['Residential Apartment']},
+        {'type': 'BEDROOM_NUM', 'value': ['2 BHK']},
+    ]),
+    ('search locality', [{'type': 'LOCALITY', 'value': ['Andheri West']}]),
+    ('search keywords + city', [
+        {'type': 'CITY', 'value': ['Mumbai']},
+        {'type': 'KEYWORDS', 'value': ['sea facing']},
+    ]),
+]
+
+
+def _existing_tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _table_columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _applicable_indexes(conn):
+    # Those whose table and columns exist
+    tables = _existing_tables(conn)
+    for name, (table, columns) in INDEXES.items():
+        if table not in tables:
+            continue
+        if not {column.strip() for column in columns.split(',')} <= _table_columns(conn, table):
+            continue
+        yield name, table, columns
+
+
+def create_indexes(conn):
+    """Creates every index whose table and columns exist; returns their names."""
+    created = []
+    for name, table, columns in _applicable_indexes(conn):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+        created.append(name)
+    conn.commit()
+    return created
+
+
+def missing_indexes(conn):
+    """Names of the applicable indexes that don't exist yet."""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    return [name for name, _, _ in _applicable_indexes(conn) if name not in existing]
+
+
+def create_missing_indexes(db_path, lock_path=None):
+    """Builds the missing indexes once for all server workers; returns the
+    names built here.
+
+    Cheap when nothing is missing. Otherwise an exclusive ``flock`` on
+    ``lock_path`` (default: next to the database) lets one worker build
+    while the others wait and then find nothing left to do. The build uses
+    its own connection with ``BUILD_BUSY_TIMEOUT_MS`` and is retried if the
+    database stays locked.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUILD_BUSY_TIMEOUT_MS / 1000)
+    lock_fd = None
+    try:
+        if not missing_indexes(conn):
+            return []
+        if fcntl is not None:
+            lock_fd = os.open(lock_path or f'{db_path}.indexes.lock', os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        for attempt in range(1, BUILD_ATTEMPTS + 1):
+            try:
+                missing = missing_indexes(conn)
+                for name, table, columns in _applicable_indexes(conn):
+                    if name in missing:
+                        started = time.perf_counter()
+                        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+                        conn.commit()
+                        logger.info(f'Built index {name} in {time.perf_counter() - started:.1f}s')
+                return missing
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                if 'locked' not in str(e) or attempt == BUILD_ATTEMPTS:
+                    raise
+                logger.warning(f'Index build attempt {attempt} failed ({e}), retrying')
+    finally:
+        if lock_fd is not None:
+            os.close(lock_fd)  # releases the flock
+        conn.close()
+
+
+def analyze(conn):
+    conn.execute('ANALYZE')
+    conn.commit()
+
+
+def _hot_queries(conn):
+    yield from HOT_QUERIES
+    if 'prop_data' in _existing_tables(conn):
+        prepare_connection(conn)
+        builder = PropertyQueryBuilder.for_connection(conn)
+        for name, filters in HOT_SEARCHES:
+            yield (name, *builder.build(filters))
+
+
+def explain_report(conn):
+    """Runs EXPLAIN QUERY PLAN over the hot queries.
+
+    Returns ``[(name, status, plan_lines)]`` where status is ``'ok'``,
+    ``'scan'`` (a table is read without an index) or ``'skipped'`` (its
+    tables aren't in this database).
+    """
+    report = []
+    for name, sql, params in _hot_queries(conn):
+        try:
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+        except sqlite3.OperationalError as e:
+            report.append((name, 'skipped', [str(e)]))
+            continue
+        scans = [line for line in plan if line.startswith('SCAN') and 'INDEX' not in line]
+        report.append((name, 'scan' if scans else 'ok', plan))
+    return report
+
+
+def print_report(report):
+    """Prints the report; returns False if any hot query scans a table."""
+    print("\nQuery plans:")
+    for name, status, plan in report:
+        marker = {'ok': '✓', 'scan': '❌', 'skipped': '-'}[status]
+        print(f"{marker} {name.ljust(30)} {'; '.join(plan)}")
+    scanning = [name for name, status, _ in report if status == 'scan']
+    if scanning:
+        print(f"\n❌ Full table scans in hot queries: {', '.join(scanning)}")
+    return not scanning
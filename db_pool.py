@@ -0,0 +1,161 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Pragmas applied to every pooled connection. WAL lets the API read while the
+# Rasa SQL tracker store commits, busy_timeout waits out short write locks
+# instead of failing with "database is locked".
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -20000,       # ~20 MB page cache per connection
+    "mmap_size": 268435456,     # 256 MB memory-mapped I/O
+    "busy_timeout": 5000,       # ms
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+
+def apply_pragmas(conn, pragmas=None):
+    for name, value in (pragmas or DEFAULT_PRAGMAS).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by the threads of one process.
+
+    Connections are opened lazily, tuned with ``DEFAULT_PRAGMAS`` and handed
+    back with ``release()`` instead of being closed. The pool notices when it
+    is used from a forked worker and starts over with fresh connections, so
+    each server worker ends up with its own pool.
+    """
+
+    def __init__(self, db_path, max_size=8, timeout=30.0, pragmas=None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = pragmas or DEFAULT_PRAGMAS
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.max_size)
+        self._all = set()
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "waits": 0,
+            "wait_time_ms": 0.0,
+            "closed": 0,
+            "errors": 0,
+        }
+
+    def _check_pid(self):
+        # Connections must never cross a fork; drop inherited handles.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.pragmas.get("busy_timeout", 5000) / 1000,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        apply_pragmas(conn, self.pragmas)
+        return conn
+
+    def _count(self, name, amount=1):
+        # Threadpool threads update the counters concurrently
+        with self._lock:
+            self._stats[name] += amount
+
+    def acquire(self):
+        self._check_pid()
+        try:
+            conn = self._idle.get_nowait()
+            self._count("reused")
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self.max_size:
+                conn = self._connect()
+                self._all.add(conn)
+                self._stats["created"] += 1
+                return conn
+
+        # Pool exhausted: wait for another thread to hand a connection back.
+        self._count("waits")
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            self._count("errors")
+            raise TimeoutError(f"No SQLite connection available after {self.timeout}s")
+        with self._lock:
+            self._stats["wait_time_ms"] += (time.perf_counter() - started) * 1000
+            self._stats["reused"] += 1
+        return conn
+
+    def release(self, conn):
+        if conn not in self._all:
+            # Connection belongs to a pool from before a fork, or was discarded.
+            conn.close()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._all.discard(conn)
+        try:
+            conn.close()
+        finally:
+            self._count("closed")
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except Exception:
+            self._count("errors")
+            raise
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._stats)
+        return {
+            **counters,
+            "pid": self._pid,
+            "db_path": self.db_path,
+            "max_size": self.max_size,
+            "open": len(self._all),
+            "idle": self._idle.qsize(),
+            "in_use": len(self._all) - self._idle.qsize(),
+        }
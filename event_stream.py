@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from collections import defaultdict
+
+from db_pool import apply_pragmas
+
+logger = logging.getLogger(__name__)
+
+STREAMED_EVENT_TYPES = ('user', 'bot', 'slot')
+
+
+def format_event(row):
+    payload = json.loads(row['data'])
+    event = {
+        'id': row['id'],
+        'type': row['type_name'],
+        'text': payload.get('text'),
+        'data': payload.get('data'),
+        'event': payload.get('event'),
+        'timestamp': row['timestamp'],
+    }
+    if row['type_name'] == 'slot':
+        event['name'] = payload.get('name')
+        event['value'] = payload.get('value')
+    return event
+
+
+def fetch_events_since(conn, sender_id, since_id):
+    rows = conn.execute(f'''
+        SELECT id, sender_id, type_name, timestamp, data
+        FROM events
+        WHERE sender_id = ?
+          AND id > ?
+          AND type_name IN ({', '.join('?' for _ in STREAMED_EVENT_TYPES)})
+        ORDER BY id
+    ''', (sender_id, since_id, *STREAMED_EVENT_TYPES)).fetchall()
+    return [format_event(row) for row in rows]
+
+
+def sse_message(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+class EventBroadcaster:
+    """Tails the tracker store's events table and fans new rows out per sender.
+
+    One watcher per worker process keeps its own connection and checks
+    ``PRAGMA data_version``, which only changes when another connection
+    commits, so an idle database costs one pragma per tick. When it does
+    change, only rows past the last seen id are read and pushed to the
+    queues of the senders that are subscribed.
+    """
+
+    def __init__(self, db_path, poll_interval=0.25, queue_size=1000):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._conn = None
+        self._data_version = None
+        self._last_id = None
+        self._task = None
+
+    def subscribe(self, sender_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[sender_id].add(queue)
+        return queue
+
+    def unsubscribe(self, sender_id, queue):
+        queues = self._subscribers.get(sender_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[sender_id]
+
+    def subscriber_count(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        apply_pragmas(conn)
+        return conn
+
+    def _poll(self, deliver=True):
+        if self._conn is None:
+            self._conn = self._connect()
+
+        data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version and self._last_id is not None:
+            return []
+        self._data_version = data_version
+
+        if self._last_id is None or not deliver:
+            # Nobody is listening: just move the cursor to the end of the log.
+            # Subscribers catch up on anything older through the REST endpoint.
+            self._last_id = self._conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+            return []
+
+        rows = self._conn.execute('''
+            SELECT id, sender_id, type_name, timestamp, data
+            FROM events
+            WHERE id > ?
+            ORDER BY id
+        ''', (self._last_id,)).fetchall()
+        if rows:
+            self._last_id = rows[-1]['id']
+        return [row for row in rows if row['type_name'] in STREAMED_EVENT_TYPES]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                rows = await asyncio.to_thread(self._poll, bool(self._subscribers))
+            except sqlite3.Error as e:
+                logger.debug(f'Event stream poll failed: {e}')
+                continue
+            for row in rows:
+                self._dispatch(row)
+
+    def _dispatch(self, row):
+        queues = self._subscribers.get(row['sender_id'])
+        if not queues:
+            return
+        event = format_event(row)
+        for queue in list(queues):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: end its stream. EventSource reconnects with
+                # Last-Event-ID and catches up from the database.
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                self.unsubscribe(row['sender_id'], queue)
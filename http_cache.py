@@ -0,0 +1,87 @@
+import gzip
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+
+import orjson
+from fastapi import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+
+# ETags are weak: the same representation may be sent gzip, brotli or plain.
+def make_etag(*parts):
+    return 'W/"' + '-'.join(str(part) for part in parts) + '"'
+
+
+def content_etag(body):
+    return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def is_not_modified(request, etag=None, last_modified=None):
+    """Evaluates If-None-Match / If-Modified-Since against the current state."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since when both are sent
+        if etag is None:
+            return False
+        candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in candidates or etag.removeprefix('W/') in candidates
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _validator_headers(etag, last_modified, cache_control):
+    headers = {'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if etag is not None:
+        headers['ETag'] = etag
+    if last_modified is not None:
+        headers['Last-Modified'] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def not_modified_response(etag=None, last_modified=None, cache_control='no-cache'):
+    return Response(status_code=304, headers=_validator_headers(etag, last_modified, cache_control))
+
+
+def json_response(request, payload, etag=None, last_modified=None,
+                  cache_control='no-cache', status_code=200):
+    """Serializes ``payload`` with orjson and answers conditionally.
+
+    Without an explicit ``etag`` one is derived from the body, which still
+    saves the transfer on a 304. Bodies above ``COMPRESS_MIN_SIZE`` are
+    compressed with brotli or gzip, whichever the client accepts.
+    """
+    body = orjson.dumps(payload)
+    if etag is None:
+        etag = content_etag(body)
+    if status_code == 200 and is_not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified, cache_control)
+
+    headers = _validator_headers(etag, last_modified, cache_control)
+    if len(body) >= COMPRESS_MIN_SIZE:
+        accepted = {
+            encoding.split(';')[0].strip()
+            for encoding in request.headers.get('accept-encoding', '').split(',')
+        }
+        if brotli is not None and 'br' in accepted:
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+            headers['Content-Encoding'] = 'br'
+        elif 'gzip' in accepted:
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            headers['Content-Encoding'] = 'gzip'
+
+    return Response(content=body, status_code=status_code,
+                    media_type='application/json', headers=headers)
@@ -15,8 +15,8 @@ start_service() {
 
 trap 'kill $(jobs -p)' EXIT
 
-start_service "API" "python server.py"
-# start_service "API" "uvicorn server:app --host 0.0.0.0 --port 5055 --reload"
+# start_service "API" "python server.py"
+start_service "API" "uvicorn server:app --host 0.0.0.0 --port 5055 --workers ${API_WORKERS:-4}"
 start_service "Calling Bot Rasa" "cd calling_bot_calm && rasa run"
 start_service "Real Estate Bot Rasa" "cd realstate_bot_calm && rasa run --enable-api --cors '*' --port 5006"
 start_service "Frontend" "cd frontent_rasa_custom && http-server -p 8000 --cors"
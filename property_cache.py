@@ -0,0 +1,150 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CARD_COLUMNS = (
+    'PRICE',
+    'PHOTO_URL',
+    'PROP_HEADING',
+    'BEDROOM_NUM',
+    'BATHROOM_NUM',
+    'PROPERTY_TYPE',
+    'LOCALITY',
+    'BUILTUP_SQFT',
+    'PROP_ID',
+)
+
+# SQLite's default limit on bound parameters is 999 on older builds
+MAX_IDS_PER_QUERY = 500
+
+
+def format_property(property):
+    return {
+        'id': property['PROP_ID'],
+        'title': property['PROP_HEADING'],
+        'price': property['PRICE'],
+        'address': property['LOCALITY'],
+        'bedrooms': property['BEDROOM_NUM'],
+        'bathrooms': property['BATHROOM_NUM'],
+        'area': f"{property['BUILTUP_SQFT']} sqft",
+        'type': property['PROPERTY_TYPE'],
+        'description': 'No description available',
+        'images': [property['PHOTO_URL']] if property['PHOTO_URL'] else ['https://via.placeholder.com/800x600?text=No+Image+Available'],
+        'amenities': ['Not specified'],
+        'agent': {
+            'name': 'Unknown Agent',
+            'phone': 'Not available',
+            'email': 'no-email@example.com',
+            'avatar': 'https://via.placeholder.com/150?text=Agent',
+            'title': 'Real Estate Agent'
+        }
+    }
+
+
+def read_data_version(conn, key='prop_data_version'):
+    """Returns ``(value, updated_at)`` of the stamp table_create.py writes
+    after (re)loading prop_data."""
+    try:
+        row = conn.execute('SELECT value, updated_at FROM data_meta WHERE key = ?', (key,)).fetchone()
+    except sqlite3.OperationalError:
+        # Database created before data_meta existed
+        return None, None
+    return (row[0], row[1]) if row else (None, None)
+
+
+class PropertyCardCache:
+    """Bounded LRU of formatted property cards, keyed by PROP_ID.
+
+    The cache remembers which prop_data version it was filled from and
+    empties itself when table_create.py publishes a new one. The version is
+    re-read at most every ``version_check_interval`` seconds.
+    """
+
+    def __init__(self, max_size=5000, version_check_interval=2.0):
+        self.max_size = max_size
+        self.version_check_interval = version_check_interval
+        self._cards = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_updated_at = None
+        self._version_checked_at = 0.0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _check_version(self, conn):
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check_interval:
+            return
+        version, updated_at = read_data_version(conn)
+        with self._lock:
+            self._version_checked_at = now
+            if version != self._version:
+                if self._cards:
+                    self._stats['invalidations'] += 1
+                self._cards.clear()
+                self._version = version
+                self._version_updated_at = updated_at
+
+    def version_info(self, conn):
+        """Current ``(data_version, updated_at)``, for HTTP validators."""
+        self._check_version(conn)
+        return self._version, self._version_updated_at
+
+    def invalidate(self):
+        with self._lock:
+            self._cards.clear()
+            self._version_checked_at = 0.0
+            self._stats['invalidations'] += 1
+
+    def get_many(self, conn, property_ids):
+        """Returns ``{property_id: card}`` for the ids that exist.
+
+        Cached cards are served directly; the rest are resolved with one
+        ``PROP_ID IN (...)`` query per chunk of ids.
+        """
+        self._check_version(conn)
+
+        found = {}
+        missing = []
+        with self._lock:
+            for property_id in dict.fromkeys(str(pid) for pid in property_ids):
+                card = self._cards.get(property_id)
+                if card is None:
+                    missing.append(property_id)
+                else:
+                    self._cards.move_to_end(property_id)
+                    found[property_id] = card
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += len(missing)
+
+        for start in range(0, len(missing), MAX_IDS_PER_QUERY):
+            chunk = missing[start:start + MAX_IDS_PER_QUERY]
+            rows = conn.execute(f'''
+                SELECT {', '.join(CARD_COLUMNS)}
+                FROM prop_data
+                WHERE PROP_ID IN ({', '.join('?' for _ in chunk)})
+            ''', chunk).fetchall()
+            for row in rows:
+                found[str(row['PROP_ID'])] = format_property(row)
+
+        with self._lock:
+            for property_id in missing:
+                if property_id in found:
+                    self._cards[property_id] = found[property_id]
+            while len(self._cards) > self.max_size:
+                self._cards.popitem(last=False)
+                self._stats['evictions'] += 1
+
+        return found
+
+    def get(self, conn, property_id):
+        return self.get_many(conn, [property_id]).get(str(property_id))
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                'size': len(self._cards),
+                'max_size': self.max_size,
+                'data_version': self._version,
+            }
@@ -0,0 +1,252 @@
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; turns are then serialized per worker only
+    fcntl = None
+
+DEFAULT_LOCK_DIR = os.path.join(tempfile.gettempdir(), 'rasa_sender_locks')
+LOCK_POLL_SECONDS = (0.005, 0.1)
+METRICS_PUBLISH_SECONDS = 1.0
+
+
+class RasaClient:
+    """Keep-alive client for the Rasa REST webhook.
+
+    Messages from the same sender are sent one at a time, in arrival order,
+    so Rasa never processes two turns of one conversation concurrently.
+    Different senders share the connection pool and run in parallel.
+
+    The API runs several uvicorn workers, so a sender's turn also holds an
+    advisory ``flock`` on that sender's own file in ``lock_dir``, shared by
+    every worker on the host and removed once no turn holds it. Within a
+    worker turns keep arrival order; across workers they are only kept
+    apart. Each worker also writes its metrics to ``lock_dir`` so
+    ``metrics()`` can report all of them.
+    """
+
+    def __init__(self, webhook_url, connect_timeout=5.0, read_timeout=60.0,
+                 max_connections=100, max_keepalive_connections=20, latency_window=500,
+                 lock_dir=DEFAULT_LOCK_DIR):
+        self.webhook_url = webhook_url
+        self.lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+        self._metrics_published_at = 0.0
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+        )
+        # sender_id -> [lock, number of requests holding or waiting for it]
+        self._senders = {}
+        self._latencies = deque(maxlen=latency_window)
+        self._metrics = {
+            'requests': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'in_flight': 0,
+            'max_queue_depth': 0,
+            'cross_worker_waits': 0,
+        }
+
+    @asynccontextmanager
+    async def _sender_turn(self, sender_id):
+        entry = self._senders.setdefault(sender_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self._metrics['max_queue_depth'] = max(self._metrics['max_queue_depth'], entry[1])
+        try:
+            async with entry[0]:
+                path = os.path.join(self.lock_dir, f'sender-{hashlib.sha1(sender_id.encode()).hexdigest()}.lock')
+                fd = await self._lock_across_workers(path)
+                try:
+                    yield
+                finally:
+                    if fd is not None:
+                        if entry[1] == 1:
+                            # No turn of this sender waits here; one waiting in
+                            # another worker sees the file is gone and retries
+                            try:
+                                os.remove(path)
+                            except OSError:
+                                pass
+                        os.close(fd)  # releases the flock
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._senders[sender_id]
+            if time.monotonic() - self._metrics_published_at >= METRICS_PUBLISH_SECONDS:
+                self._metrics_published_at = time.monotonic()
+                await asyncio.to_thread(self._publish_metrics, self._snapshot())
+
+    async def _lock_across_workers(self, path):
+        """Exclusive flock on the sender's lock file; returns its fd.
+
+        Polled without blocking, so a waiting request never ties up a
+        thread and can still be cancelled.
+        """
+        if fcntl is None:
+            return None
+        delay, max_delay = LOCK_POLL_SECONDS
+        waited = False
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                while True:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if not waited:
+                            waited = True
+                            self._metrics['cross_worker_waits'] += 1
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, max_delay)
+                # The previous holder may have removed the file before releasing
+                # it; a lock on the removed file excludes nobody
+                try:
+                    current = os.fstat(fd).st_ino == os.stat(path).st_ino
+                except FileNotFoundError:
+                    current = False
+            except BaseException:
+                os.close(fd)
+                raise
+            if current:
+                return fd
+            os.close(fd)
+
+    async def send(self, sender_id, message, input_channel='web', metadata=None):
+        async with self._sender_turn(sender_id):
+            self._metrics['requests'] += 1
+            self._metrics['in_flight'] += 1
+            started = time.perf_counter()
+            try:
+                response = await self._client.post(
+                    self.webhook_url,
+                    json={
+                        'sender': sender_id,
+                        'message': message,
+                        'stream': True,
+                        'input_channel': input_channel,
+                        'metadata': metadata or {}
+                    }
+                )
+                response.raise_for_status()
+                return response.json()
+            except httpx.TimeoutException:
+                self._metrics['timeouts'] += 1
+                self._metrics['errors'] += 1
+                raise
+            except httpx.HTTPError:
+                self._metrics['errors'] += 1
+                raise
+            finally:
+                self._metrics['in_flight'] -= 1
+                self._latencies.append((time.perf_counter() - started) * 1000)
+
+    def _snapshot(self):
+        return {
+            'pid': os.getpid(),
+            'metrics': dict(self._metrics),
+            'queue_depth': {sender_id: count for sender_id, (_, count) in self._senders.items()},
+            'latencies': list(self._latencies),
+        }
+
+    def _publish_metrics(self, snapshot):
+        # Runs in a thread. Written to a temp file and renamed, so readers
+        # never see half of it
+        path = os.path.join(self.lock_dir, f'metrics-{os.getpid()}.json')
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _worker_snapshots(self, own):
+        # This worker's live numbers plus the last ones every other running
+        # worker published
+        snapshots = [own]
+        for path in glob.glob(os.path.join(self.lock_dir, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+                pid = snapshot['pid']
+                if pid == os.getpid():
+                    continue
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(path)  # worker exited
+                except OSError:
+                    pass
+                continue
+            except (OSError, ValueError, KeyError):
+                continue
+            snapshots.append(snapshot)
+        return snapshots
+
+    async def metrics(self):
+        """Counters, queue depths and upstream latency summed over every
+        worker on this host; other workers' numbers are at most
+        ``METRICS_PUBLISH_SECONDS`` behind their last request."""
+        # Snapshot on the event loop, which is what mutates the counters;
+        # the file I/O runs in a thread
+        self._metrics_published_at = time.monotonic()
+        return await asyncio.to_thread(self._aggregate_metrics, self._snapshot())
+
+    def _aggregate_metrics(self, own):
+        self._publish_metrics(own)
+        snapshots = self._worker_snapshots(own)
+        totals = {}
+        depths = {}
+        latencies = []
+        for snapshot in snapshots:
+            for name, value in snapshot['metrics'].items():
+                if name == 'max_queue_depth':
+                    totals[name] = max(totals.get(name, 0), value)
+                else:
+                    totals[name] = totals.get(name, 0) + value
+            for sender_id, count in snapshot['queue_depth'].items():
+                depths[sender_id] = depths.get(sender_id, 0) + count
+            latencies += snapshot['latencies']
+        latencies.sort()
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+
+        return {
+            **totals,
+            'workers': len(snapshots),
+            'active_senders': len(depths),
+            'queued': sum(count - 1 for count in depths.values()),
+            'queue_depth': dict(sorted(depths.items(), key=lambda item: -item[1])[:20]),
+            'upstream_latency_ms': {
+                'samples': len(latencies),
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(latencies[-1], 1) if latencies else None,
+            },
+        }
+
+    async def aclose(self):
+        await self._client.aclose()
+        try:
+            os.remove(os.path.join(self.lock_dir, f'metrics-{os.getpid()}.json'))
+        except OSError:
+            pass
@@ -14,8 +14,11 @@ import logging
 logger = logging.getLogger(__name__)
 
 import sqlite3
+import threading
 from pathlib import Path
-import pandas as pd
+
+from . import column_search, facet_bitmaps, filter_store, query_builder
+
 # Define the SQLite database path
 db_path = "/workspaces/Rasa_challenge/rasa.db"
 
@@ -89,45 +92,99 @@ def format_properties(data):
 
 
 
-def GetDataFromDB(query):
-    
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_path)
-    table_name = 'prop_data'  # Change to the table you want to read
-    
-    df = pd.read_sql_query(query, conn)
-    data = df.to_dict(orient="records")
-    
-    conn.close()
-    
-    return data
+_local = threading.local()
+
+def StartSearchEngine():
+    # Opt-in (COLUMNAR_SEARCH=1, needs numpy): filters are evaluated on
+    # in-memory arrays instead of SQLite; anything it can't handle uses SQL
+    if os.environ.get("COLUMNAR_SEARCH") != "1":
+        return None
+    if not column_search.available():
+        logger.warning("COLUMNAR_SEARCH is set but numpy is not installed; using SQL search")
+        return None
+    engine = column_search.ColumnarSearchEngine(db_path)
+    try:
+        engine.load()
+    except Exception as e:
+        logger.error(f"Columnar search engine not loaded at startup, will retry on first search: {e}")
+    return engine
+
+SEARCH_ENGINE = StartSearchEngine()
+
+# Facet bitmaps are shared by all threads: (prop_data version, index or None)
+BITMAP_CANDIDATE_LIMIT = 1000
+_facet_index = (None, None)
+_facet_index_lock = threading.Lock()
+
+def GetConnection():
+    # One connection per action-server thread, kept open so sqlite3's
+    # statement cache can reuse the prepared search queries
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA busy_timeout = 5000")
+        query_builder.prepare_connection(conn)
+        _local.conn = conn
+    return conn
+
+def GetDataVersion(conn):
+    try:
+        row = conn.execute("SELECT value FROM data_meta WHERE key = 'prop_data_version'").fetchone()
+        return row[0] if row else None
+    except sqlite3.OperationalError:
+        return None
+
+def GetQueryBuilder(conn):
+    # prop_data's columns change only when table_create.py reloads it
+    version = GetDataVersion(conn)
+    builder = getattr(_local, "builder", None)
+    if builder is None or getattr(_local, "builder_version", None) != version:
+        builder = query_builder.PropertyQueryBuilder.for_connection(conn)
+        _local.builder = builder
+        _local.builder_version = version
+    return builder
+
+def GetFacetIndex(conn):
+    # Loaded from the facet_bitmaps table once per prop_data version; None
+    # until table_create.py has built it for the current data
+    global _facet_index
+    version = GetDataVersion(conn)
+    with _facet_index_lock:
+        cached_version, index = _facet_index
+        if index is None or cached_version != version:
+            index = facet_bitmaps.load(conn)
+            _facet_index = (version, index)
+    return index
+
+def GetDataFromDB(query, params=()):
+    # Rows as dicts straight from the cursor; building a DataFrame only to
+    # call to_dict cost more than the query. Bulk column scans should use
+    # prop_snapshot.load_snapshot instead.
+    cursor = GetConnection().execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 def GetFiltersFromDB(sender_id):
     
     # Connect to the SQLite database
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Get the most recent filter entry
-    cursor.execute('''
-            SELECT data 
-            FROM saved_preferences 
-            WHERE sender_id = ? 
-                AND action_name = 'final_text_filters' 
-                AND type_name = 'slot'
-            ORDER BY timestamp DESC 
-            LIMIT 1
-        ''', (sender_id,))
-        
-    filter_event = cursor.fetchone()
     try:
-        event_data = json.loads(filter_event[0])
-        filters = event_data.get('value', [])
+        filters = filter_store.load_filters(conn, sender_id)
         print("filter_event",filters)
         return filters
-    except:
+    except Exception:
         return []
+    finally:
+        conn.close()
     
+def GetFiltersFromTracker(tracker):
+    # Filters the GeminiEntityExtractor attached to the latest user message;
+    # None when extraction didn't run or failed for that message
+    for entity in tracker.latest_message.get('entities', []):
+        if entity.get('entity') == filter_store.FILTERS_SLOT and entity.get('extractor') == 'GeminiEntityExtractor':
+            return entity.get('value') or []
+    return None
+
 def LLMConnection(prompt):
     api_url = "https://api.mistral.ai/v1/chat/completions"  # Removed comma
     api_key = os.environ.get("GEMINI_API_KEY")  # Removed comma
@@ -223,62 +280,78 @@ def CustomSlotSet(tracker):
         
         return slot_sets
     
-def GetPropertyData(filters):
-    conditions = []
-    for filter_item in filters:
-        
-        col_type = filter_item['type']
-        values = filter_item.get('value', [])
-        if not values:
-            continue
-        
-        processed_values = []
-        for v in values:
+def GetPropertiesByRowids(rowids):
+    # Card rows in rowid order, shaped like a "relevance" page of build()
+    if not rowids:
+        return []
+    columns = ", ".join(query_builder.CARD_COLUMNS)
+    placeholders = ", ".join("?" for _ in rowids)
+    return GetDataFromDB(
+        f"SELECT {columns}, rowid AS sort_key, rowid AS row_id FROM prop_data "
+        f"WHERE rowid IN ({placeholders}) ORDER BY rowid", rowids
+    )
+
+def GetPropertyRows(conn, filters, sort, after, limit):
+    # Unranked relevance is rowid order, which the in-memory indexes can
+    # page through themselves
+    after_rowid = after[1] if after is not None else None
+    if sort == query_builder.DEFAULT_SORT:
+        if SEARCH_ENGINE is not None:
             try:
-                if col_type == "BEDROOM_NUM":
-                    num = int(v.split()[0])
-                    processed_values.append(str(num))
-                elif col_type == "BATHROOM_NUM":
-                    num = int(v.replace('+', ''))
-                    processed_values.append(str(num))
-                else:
-                    escaped = str(v).replace("'", "''")
-                    processed_values.append(f"'{escaped}'")
-            except (ValueError, IndexError, AttributeError):
-                continue
-        
-        if not processed_values:
-            continue
-        
-        if col_type in ["BEDROOM_NUM", "BATHROOM_NUM"]:
-            in_clause = f"{col_type} IN ({', '.join(processed_values)})"
-        else:
-            in_clause = f"{col_type} IN ({', '.join(processed_values)})"
-        conditions.append(in_clause)
-    
-    # Add conditions to exclude None values and "Price on Request"
-    exclude_none_conditions = [
-        "PHOTO_URL IS NOT NULL",
-        "PROP_HEADING IS NOT NULL",
-        "BEDROOM_NUM IS NOT NULL",
-        "BATHROOM_NUM IS NOT NULL",
-        "PROPERTY_TYPE IS NOT NULL",
-        "LOCALITY IS NOT NULL",
-        "BUILTUP_SQFT IS NOT NULL",
-        "PRICE != 'Price on Request'"
-    ]
-    
-    if not conditions:
-        where_clause = " AND ".join(exclude_none_conditions)
-    else:
-
-        where_clause = " OR ".join(conditions) + " AND " + " AND ".join(exclude_none_conditions)
-
-    
-    if not where_clause:
-        return ""
-    
-    return f"SELECT PRICE, PHOTO_URL, PROP_HEADING, BEDROOM_NUM, BATHROOM_NUM, PROPERTY_TYPE, CITY, BUILTUP_SQFT, PROP_ID FROM prop_data WHERE {where_clause} LIMIT 5;"
+                rowids = SEARCH_ENGINE.search(filters, limit, after_rowid)
+                if rowids is not None:
+                    return GetPropertiesByRowids(rowids)
+            except Exception as e:
+                logger.error(f"Columnar search failed, falling back to SQL: {e}")
+    rowids = None
+    index = GetFacetIndex(conn)
+    if index is not None:
+        # Facet filters (city, type, BHK, amenities, ...) as bitmap AND/ORs;
+        # SQL only sees the rest, restricted to the bitmap's candidates
+        bitmap_query, complete = index.query_for_filters(filters)
+        if complete and sort == query_builder.DEFAULT_SORT:
+            return GetPropertiesByRowids(index.rowids_of(index.evaluate(bitmap_query), limit, after_rowid))
+        if index.estimate(bitmap_query) <= BITMAP_CANDIDATE_LIMIT:
+            bits = index.evaluate(bitmap_query)
+            if not bits:
+                return []
+            if bits.bit_count() <= BITMAP_CANDIDATE_LIMIT:
+                rowids = index.rowids_of(bits)
+    # Bound parameters throughout; see query_builder for how each filter type maps to SQL
+    query, params = GetQueryBuilder(conn).build(filters, limit=limit, rowids=rowids, sort=sort, after=after)
+    return GetDataFromDB(query, params)
+
+def GetPropertyPage(filters, sort=query_builder.DEFAULT_SORT, cursor=None, limit=5):
+    """One page of results in ``sort`` order, continuing from ``cursor``
+    (from a previous page of the same search), the cursor for the next
+    page (None after the last one), and whether ``cursor`` was followed.
+    A cursor from a different search or data version starts over at the
+    first page."""
+    if sort not in query_builder.SORT_ORDERS:
+        sort = query_builder.DEFAULT_SORT
+    conn = GetConnection()
+    fingerprint = query_builder.cursor_fingerprint(filters, sort, GetDataVersion(conn))
+    after = query_builder.decode_cursor(cursor, fingerprint)
+    # One extra row tells whether there is a next page
+    rows = GetPropertyRows(conn, filters, sort, after, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = query_builder.encode_cursor(fingerprint, rows[-1]["sort_key"], rows[-1]["row_id"])
+    return rows, next_cursor, after is not None
+
+def GetPropertyData(filters, limit=5):
+    return GetPropertyPage(filters, limit=limit)[0]
+
+def SearchSlots(filters, sort, next_cursor):
+    # "show more" pages through the search as it was issued, not through
+    # whatever the filters read as on that later turn
+    search = {"filters": filters, "sort": sort} if next_cursor else None
+    return [SlotSet("search_cursor", next_cursor), SlotSet("search_query", search)]
+
+def GetSortFromTracker(tracker):
+    sort = tracker.get_slot("search_sort")
+    return sort if sort in query_builder.SORT_ORDERS else query_builder.DEFAULT_SORT
 
 class ActionSearchProperties(Action):
     def name(self) -> Text:
@@ -289,19 +362,24 @@ class ActionSearchProperties(Action):
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
         try:
-            filters = GetFiltersFromDB(tracker.sender_id)
-            query = GetPropertyData(filters)
-            data = GetDataFromDB(query)
+            filters = GetFiltersFromTracker(tracker)
+            if filters is None:
+                filters = GetFiltersFromDB(tracker.sender_id)
+            # A new search always starts at the first page
+            sort = GetSortFromTracker(tracker)
+            data, next_cursor, _ = GetPropertyPage(filters, sort=sort)
 
             data = format_properties(data)
 
             if not data:
                 dispatcher.utter_message("I'm sorry, I couldn't find any properties matching your exact criteria. Would you like to try a modifying search?")
                 dispatcher.utter_message("P.S., Currenty i support these few locations Secunderabad, Hyderabad, Kolkata, Navi Mumbai, Thane, Mumbai, Gurgaon?")
-                return []
+                return SearchSlots(filters, sort, None)
 
             dispatcher.utter_message("Here are your search results:", json_message=data)
-            return []
+            if next_cursor:
+                dispatcher.utter_message("Say \"show more\" to see more properties.")
+            return SearchSlots(filters, sort, next_cursor)
 
         except Exception as e:
             error_details = traceback.format_exc()
@@ -309,6 +387,50 @@ class ActionSearchProperties(Action):
             dispatcher.utter_message("An error occurred while searching for properties. Please try again by rephrasing or modifying the filters.")
             return []
 
+class ActionShowMoreProperties(Action):
+    def name(self) -> Text:
+        return "action_show_more_properties"
+
+    def run(self, dispatcher: CollectingDispatcher,
+            tracker: Tracker,
+            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+
+        try:
+            cursor = tracker.get_slot("search_cursor")
+            if not cursor:
+                dispatcher.utter_message("That's everything that matches your search. Would you like to modify the filters?")
+                return []
+
+            search = tracker.get_slot("search_query") or {}
+            filters, sort = search.get("filters"), search.get("sort")
+            if filters is None:
+                filters = GetFiltersFromTracker(tracker)
+                if filters is None:
+                    filters = GetFiltersFromDB(tracker.sender_id)
+                sort = GetSortFromTracker(tracker)
+            # Continues where the last page ended; if the listings were
+            # reloaded since, the cursor no longer applies and this is page one
+            data, next_cursor, continued = GetPropertyPage(filters, sort=sort, cursor=cursor)
+            data = format_properties(data)
+
+            if not data:
+                dispatcher.utter_message("That's everything that matches your search. Would you like to modify the filters?")
+                return SearchSlots(filters, sort, None)
+
+            if continued:
+                dispatcher.utter_message("Here are more properties:", json_message=data)
+            else:
+                dispatcher.utter_message("The listings have changed since your last page, so here are your results from the top:", json_message=data)
+            if not next_cursor:
+                dispatcher.utter_message("That's the last of the matching properties.")
+            return SearchSlots(filters, sort, next_cursor)
+
+        except Exception as e:
+            error_details = traceback.format_exc()
+            logger.error(f"Error in ActionShowMoreProperties: {e}\n{error_details}")
+            dispatcher.utter_message("An error occurred while loading more properties. Please try searching again.")
+            return []
+
 class ActionFetchPropertyDetails(Action):
     def name(self) -> Text:
         return "action_fetch_property_details"
@@ -470,13 +592,13 @@ class ActionShowSavedProperties(Action):
         
         try:
             # Query the database to get the saved properties based on sender_id (session_id)
-            query = f"""
+            query = """
                 SELECT p.* FROM prop_data p
-                JOIN favorites f ON p.PROP_ID = f.property_id
-                WHERE f.session_id = '{sender_id}'
+                JOIN favorites f ON p.PROP_ID = CAST(f.property_id AS TEXT)
+                WHERE f.session_id = ?
             """
             
-            saved_properties = GetDataFromDB(query)
+            saved_properties = GetDataFromDB(query, (sender_id,))
 
             if not saved_properties:
                 dispatcher.utter_message("You don't have any saved properties yet.")
@@ -0,0 +1,267 @@
+"""In-memory columnar evaluation of search filters.
+
+The filterable columns of every searchable listing are held as NumPy arrays:
+categories dictionary-encoded to integer codes, price and area as floats,
+amenities as one row-index array per amenity id. A filter set becomes a few
+vectorized comparisons ANDed into one mask. Semantics follow
+query_builder.PropertyQueryBuilder; filters the engine can't evaluate
+(e.g. KEYWORDS) make ``search`` return None so the caller uses SQL.
+
+The arrays come from the Arrow snapshot table_create.py writes
+(prop_snapshot) when it is current, which skips decoding every row through
+SQLite; otherwise from prop_data itself.
+
+NumPy is optional: without it ``available()`` is False.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; searches then go through SQL
+    np = None
+
+from . import prop_snapshot
+from .query_builder import (
+    REQUIRED_COLUMNS, PropertyQueryBuilder, _NUMBER, _range_bounds, parse_area, parse_price,
+    prepare_connection,
+)
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_COLUMNS = ["CITY", "PROPERTY_TYPE", "LOCALITY"]
+
+
+def available():
+    return np is not None
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _numbers(values):
+    if isinstance(values, np.ndarray) and values.dtype.kind in "fiu":
+        return values.astype(np.float64)
+    return np.array([_number(v) for v in values], dtype=np.float64)
+
+
+def _encode(values):
+    # Dictionary encoding: one int32 code per row plus the value -> code map
+    vocabulary = {}
+    codes = np.fromiter(
+        (vocabulary.setdefault(str(v), len(vocabulary)) if v is not None else -1 for v in values),
+        dtype=np.int32, count=len(values),
+    )
+    return codes, vocabulary
+
+
+class ColumnarSearchEngine:
+    """Evaluates ``final_text_filters`` against arrays loaded from prop_data.
+
+    The arrays are rebuilt when table_create.py publishes a new
+    ``prop_data_version``; the version is re-read at most every
+    ``version_check_interval`` seconds.
+    """
+
+    def __init__(self, db_path, version_check_interval=2.0):
+        self.db_path = db_path
+        self.version_check_interval = version_check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+        self._loaded = False
+        self._size = 0
+
+    def _read_version(self, conn):
+        try:
+            row = conn.execute("SELECT value FROM data_meta WHERE key = 'prop_data_version'").fetchone()
+        except sqlite3.OperationalError:
+            return None
+        return row[0] if row else None
+
+    def load(self):
+        """(Re)loads the arrays from prop_data; returns the row count."""
+        start = time.perf_counter()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            version = self._read_version(conn)
+            builder = PropertyQueryBuilder.for_connection(conn)
+            present = builder.columns
+            price = "PRICE_VALUE" if "PRICE_VALUE" in present else "PRICE"
+            area = "AREA_VALUE" if "AREA_VALUE" in present else "BUILTUP_SQFT"
+            selected = ["rowid", price, area, "BEDROOM_NUM", "BATHROOM_NUM", "TRANSACT_TYPE", "AMENITIES",
+                        *CATEGORY_COLUMNS]
+            data = self._read_snapshot(version, present, selected)
+            source = "snapshot"
+            if data is None:
+                source = "SQLite"
+                columns = ", ".join(c if c in present or c == "rowid" else f"NULL AS {c}" for c in selected)
+                where_clause, params = builder.where([])
+                prepare_connection(conn)
+                rows = conn.execute(
+                    f"SELECT {columns} FROM prop_data WHERE {where_clause} ORDER BY rowid", params
+                ).fetchall()
+                values = list(zip(*rows)) if rows else [()] * len(selected)
+                data = dict(zip(selected, values))
+        finally:
+            conn.close()
+
+        rowids = np.array(data["rowid"], dtype=np.int64)
+        prices = _numbers(data[price] if price == "PRICE_VALUE" else [parse_price(v) for v in data[price]])
+        areas = _numbers(data[area] if area == "AREA_VALUE" else [parse_area(v) for v in data[area]])
+        categories = {column: _encode(data[column]) for column in CATEGORY_COLUMNS}
+
+        amenities = {}
+        for row_index, value in enumerate(data["AMENITIES"]):
+            if value:
+                for amenity_id in set(str(value).replace(" ", "").split(",")):
+                    if amenity_id:
+                        amenities.setdefault(amenity_id, []).append(row_index)
+
+        with self._lock:
+            self._rowids = rowids
+            self._prices = prices
+            self._areas = areas
+            self._bedrooms = _numbers(data["BEDROOM_NUM"])
+            self._bathrooms = _numbers(data["BATHROOM_NUM"])
+            self._transact_types = _numbers(data["TRANSACT_TYPE"])
+            self._categories = categories
+            self._amenity_rows = {k: np.array(v, dtype=np.int32) for k, v in amenities.items()}
+            self._amenity_ids = builder.amenity_ids
+            self._size = len(rowids)
+            self._version = version
+            self._version_checked_at = time.monotonic()
+            self._loaded = True
+        logger.info(f"Columnar search: {self._size} listings loaded from {source} in "
+                    f"{time.perf_counter() - start:.2f}s (data version {version})")
+        return self._size
+
+    def _read_snapshot(self, version, present, selected):
+        """``selected`` columns of the searchable listings from the Arrow
+        snapshot, or None if there is no snapshot of this data version."""
+        if version is None or not prop_snapshot.available():
+            return None
+        path = prop_snapshot.snapshot_path(self.db_path)
+        if prop_snapshot.snapshot_version(path) != str(version):
+            return None
+        table = prop_snapshot.load_snapshot(path)
+        if table is None or any(c not in table.column_names for c in REQUIRED_COLUMNS):
+            return None
+
+        def column(name):
+            return table.column(name).to_numpy(zero_copy_only=False)
+
+        def not_null(name):
+            return ~table.column(name).is_null().to_numpy(zero_copy_only=False)
+
+        # The exclusions of PropertyQueryBuilder.where([])
+        keep = np.ones(table.num_rows, dtype=bool)
+        for name in REQUIRED_COLUMNS:
+            keep &= not_null(name)
+        if "PRICE_VALUE" in present:
+            keep &= not_null("PRICE_VALUE")
+        else:
+            keep &= np.array([p is not None and p != "Price on Request" for p in column("PRICE")], dtype=bool)
+
+        empty = np.full(table.num_rows, None, dtype=object)
+        return {
+            name: (column(prop_snapshot.ROWID_COLUMN) if name == "rowid"
+                   else column(name) if name in table.column_names else empty)[keep]
+            for name in selected
+        }
+
+    def _ensure_current(self):
+        now = time.monotonic()
+        if self._loaded and now - self._version_checked_at < self.version_check_interval:
+            return
+        conn = sqlite3.connect(self.db_path)
+        try:
+            version = self._read_version(conn)
+        finally:
+            conn.close()
+        if not self._loaded or version != self._version:
+            self.load()
+        else:
+            self._version_checked_at = now
+
+    def _in(self, column, values):
+        codes, vocabulary = self._categories[column]
+        wanted = [vocabulary[str(v)] for v in values if str(v) in vocabulary]
+        return np.isin(codes, np.array(wanted, dtype=np.int32))
+
+    def _range(self, array, low, high):
+        mask = ~np.isnan(array)
+        if low is not None:
+            mask &= array >= low
+        if high is not None:
+            mask &= array <= high
+        return mask
+
+    def _condition(self, col_type, value):
+        """Mask for one filter, or None if the engine can't evaluate it."""
+        if col_type == "BUDGET":
+            return self._range(self._prices, *_range_bounds(value, ("min", "MIN_PRICE"), ("max", "MAX_PRICE")))
+        if col_type == "AREA_SQFT":
+            return self._range(self._areas, *_range_bounds(value, ("min", "MIN_AREA_SQFT"), ("max", "MAX_AREA_SQFT")))
+
+        values = value if isinstance(value, list) else [value]
+        if col_type in self._categories:
+            return self._in(col_type, values)
+        if col_type == "TRANSACT_TYPE":
+            wanted = [int(v) for v in values if str(v).strip().isdigit()]
+            return np.isin(self._transact_types, wanted) if wanted else None
+        if col_type in ("BEDROOM_NUM", "BATHROOM_NUM"):
+            array = self._bedrooms if col_type == "BEDROOM_NUM" else self._bathrooms
+            exact, minimum = [], None
+            for v in values:
+                match = _NUMBER.search(str(v))
+                if not match:
+                    continue
+                num = int(float(match.group()))
+                # Bathroom options are all "at least N"
+                if "+" in str(v) or col_type == "BATHROOM_NUM":
+                    minimum = num if minimum is None else min(minimum, num)
+                else:
+                    exact.append(num)
+            if not exact and minimum is None:
+                return None
+            mask = np.isin(array, exact) if exact else np.zeros(self._size, dtype=bool)
+            if minimum is not None:
+                mask |= array >= minimum
+            return mask
+        if col_type == "AMENITIES":
+            mask = np.ones(self._size, dtype=bool)
+            for label in values:
+                amenity_id = self._amenity_ids.get(str(label).strip().lower())
+                has_amenity = np.zeros(self._size, dtype=bool)
+                if amenity_id is not None and amenity_id in self._amenity_rows:
+                    has_amenity[self._amenity_rows[amenity_id]] = True
+                elif amenity_id is None:
+                    return None  # label match needs SQL LIKE
+                mask &= has_amenity
+            return mask
+        return None
+
+    def search(self, filters, limit=5, after=None):
+        """prop_data rowids of the first ``limit`` matches in rowid order
+        (after rowid ``after``, if given), or None if some filter needs SQL."""
+        self._ensure_current()
+        with self._lock:
+            mask = np.ones(self._size, dtype=bool) if after is None else self._rowids > after
+            for filter_item in filters or []:
+                if not isinstance(filter_item, dict):
+                    continue
+                value = filter_item.get("value")
+                if value in (None, [], {}, ""):
+                    continue
+                condition = self._condition(filter_item.get("type"), value)
+                if condition is None:
+                    return None
+                mask &= condition
+            return self._rowids[np.flatnonzero(mask)[:limit]].tolist()
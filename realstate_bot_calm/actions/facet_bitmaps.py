@@ -0,0 +1,347 @@
+"""Compressed bitmap index: one bitmap per facet value.
+
+Facets are the prop_data columns that have a ``facets_*`` table (plus
+TRANSACT_TYPE). Bit ``i`` of a bitmap is the ``i``-th searchable listing in
+rowid order, using the same exclusions as the search; multi-valued columns
+(AMENITIES, FEATURES) set a bit in every value's bitmap. Bitmaps are stored
+zlib-compressed in the ``facet_bitmaps`` table, which table_create.py
+rebuilds when prop_data changes, and stay compressed in memory until a query
+touches them; AND/OR/NOT then run as Python integer operations.
+
+Queries are nested tuples: ``(facet, value)`` for one bitmap and
+``("and", q, ...)``, ``("or", q, ...)``, ``("not", q)`` to combine them::
+
+    ("and", ("CITY", "Thane"), ("or", ("BEDROOM_NUM", "2"), ("BEDROOM_NUM", "3")),
+     ("AMENITIES", "Swimming Pool"), ("AMENITIES", "Lift"))
+
+Values may be given as stored in prop_data or as the facet table's label.
+"""
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+from .query_builder import _NUMBER, PropertyQueryBuilder, prepare_connection
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS facet_bitmaps (
+        facet TEXT NOT NULL,
+        value TEXT NOT NULL,
+        cardinality INTEGER NOT NULL,
+        bitmap BLOB NOT NULL,
+        PRIMARY KEY (facet, value)
+    )""",
+]
+
+VERSION_KEY = "facet_bitmaps_version"
+# Row holding the listing rowids, in bit order
+ROWIDS_FACET = ""
+EXTRA_FACETS = ["TRANSACT_TYPE"]
+MULTI_VALUED_FACETS = {"AMENITIES", "FEATURES"}
+DECOMPRESSED_CACHE_SIZE = 64
+
+
+def _key(value):
+    """Normalized facet value: stripped text, integral numbers without
+    leading zeros or a trailing ``.0`` (so ``"002"``, ``2`` and ``2.0``
+    match)."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return str(int(number)) if number.is_integer() else text
+
+
+def _split(facet, value):
+    if facet in MULTI_VALUED_FACETS:
+        return {_key(part) for part in str(value).split(",")} - {None}
+    key = _key(value)
+    return {key} if key is not None else set()
+
+
+def facet_columns(conn):
+    """prop_data columns to index: those with a facets_* table."""
+    present = {row[1] for row in conn.execute("PRAGMA table_info(prop_data)")}
+    tables = [
+        row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'facets\\_%' ESCAPE '\\'"
+        )
+    ]
+    columns = sorted({table[len("facets_"):].upper() for table in tables} | set(EXTRA_FACETS))
+    return [column for column in columns if column in present]
+
+
+def _read_meta(conn, key):
+    try:
+        row = conn.execute("SELECT value FROM data_meta WHERE key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def build(conn, version):
+    """Rebuilds facet_bitmaps from prop_data and records ``version`` (the
+    prop_data_version it was built from). Runs in the caller's
+    transaction; returns the number of bitmaps written."""
+    for statement in SCHEMA:
+        conn.execute(statement)
+    prepare_connection(conn)
+    facets = facet_columns(conn)
+    where_clause, params = PropertyQueryBuilder.for_connection(conn).where([])
+    select = ", ".join(["rowid"] + facets)
+
+    rowids = array("q")
+    positions = {facet: {} for facet in facets}
+    for row in conn.execute(f"SELECT {select} FROM prop_data WHERE {where_clause} ORDER BY rowid", params):
+        position = len(rowids)
+        rowids.append(row[0])
+        for facet, value in zip(facets, row[1:]):
+            if value is None:
+                continue
+            for key in _split(facet, value):
+                positions[facet].setdefault(key, []).append(position)
+
+    conn.execute("DELETE FROM facet_bitmaps")
+    conn.execute(
+        "INSERT INTO facet_bitmaps (facet, value, cardinality, bitmap) VALUES (?, ?, ?, ?)",
+        (ROWIDS_FACET, "", len(rowids), zlib.compress(rowids.tobytes())),
+    )
+    written = 0
+    size = (len(rowids) + 7) // 8
+    for facet, values in positions.items():
+        rows = []
+        for value, bits in values.items():
+            bitmap = bytearray(size)
+            for position in bits:
+                bitmap[position >> 3] |= 1 << (position & 7)
+            rows.append((facet, value, len(bits), zlib.compress(bytes(bitmap))))
+        conn.executemany(
+            "INSERT INTO facet_bitmaps (facet, value, cardinality, bitmap) VALUES (?, ?, ?, ?)", rows
+        )
+        written += len(rows)
+    conn.execute(
+        "INSERT INTO data_meta (key, value, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+        (VERSION_KEY, str(version), time.time()),
+    )
+    return written
+
+
+def is_current(conn):
+    version = _read_meta(conn, VERSION_KEY)
+    return version is not None and version == str(_read_meta(conn, "prop_data_version"))
+
+
+def load(conn):
+    """The index for the current prop_data, or None if facet_bitmaps is
+    missing or was built from an older version."""
+    if not is_current(conn):
+        return None
+    rows = conn.execute("SELECT facet, value, cardinality, bitmap FROM facet_bitmaps").fetchall()
+    rowids = array("q")
+    bitmaps = {}
+    labels = {}
+    for facet, value, cardinality, blob in rows:
+        if facet == ROWIDS_FACET:
+            rowids.frombytes(zlib.decompress(blob))
+        else:
+            bitmaps[(facet, value)] = (cardinality, blob)
+    for facet in {facet for facet, _ in bitmaps}:
+        try:
+            facet_rows = conn.execute(f"SELECT id, label FROM facets_{facet.lower()}").fetchall()
+        except sqlite3.OperationalError:
+            continue
+        labels[facet] = {
+            str(label).strip().lower(): _key(facet_id) for facet_id, label in facet_rows if label is not None
+        }
+    return FacetBitmapIndex(rowids, bitmaps, labels, _read_meta(conn, VERSION_KEY))
+
+
+class FacetBitmapIndex:
+    """A loaded facet_bitmaps table. Thread-safe; bitmaps are decompressed
+    on first use and the most recent ``DECOMPRESSED_CACHE_SIZE`` are kept."""
+
+    def __init__(self, rowids, bitmaps, labels, version):
+        self.rowids = rowids
+        self.size = len(rowids)
+        self.version = version
+        self._bitmaps = bitmaps  # (facet, value) -> (cardinality, compressed bytes)
+        self._labels = labels  # facet -> {lowercased label: value}
+        self._values = {}
+        for facet, value in bitmaps:
+            self._values.setdefault(facet, []).append(value)
+        self._all = (1 << self.size) - 1
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def facets(self):
+        return sorted(self._values)
+
+    def values(self, facet):
+        return list(self._values.get(facet, []))
+
+    def resolve(self, facet, value):
+        """The stored value for ``value`` (a stored value or a facet label),
+        or None if the facet has no such value."""
+        key = _key(value)
+        if key is None:
+            return None
+        if (facet, key) in self._bitmaps:
+            return key
+        key = self._labels.get(facet, {}).get(str(value).strip().lower())
+        return key if (facet, key) in self._bitmaps else None
+
+    def _bitmap(self, facet, value):
+        key = self.resolve(facet, value)
+        if key is None:
+            return 0
+        with self._lock:
+            bits = self._cache.get((facet, key))
+            if bits is not None:
+                self._cache.move_to_end((facet, key))
+                return bits
+        bits = int.from_bytes(zlib.decompress(self._bitmaps[(facet, key)][1]), "little")
+        with self._lock:
+            self._cache[(facet, key)] = bits
+            while len(self._cache) > DECOMPRESSED_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return bits
+
+    def evaluate(self, query):
+        """The bitmap (an int, bit i = listing i) matching ``query``."""
+        op, *args = query
+        if op == "and":
+            result = self._all
+            for arg in args:
+                result &= self.evaluate(arg)
+                if not result:
+                    break
+            return result
+        if op == "or":
+            result = 0
+            for arg in args:
+                result |= self.evaluate(arg)
+            return result
+        if op == "not":
+            return self._all & ~self.evaluate(args[0])
+        return self._bitmap(op, args[0])
+
+    def count(self, query):
+        """Exact number of listings matching ``query``."""
+        return self.evaluate(query).bit_count()
+
+    def estimate(self, query):
+        """Cardinality estimate from the stored per-value counts, without
+        decompressing anything: exact for a single value or an OR within one
+        facet, assumes independent facets for AND."""
+        if not self.size:
+            return 0
+        return round(self._selectivity(query) * self.size)
+
+    def _selectivity(self, query):
+        op, *args = query
+        if op == "and":
+            result = 1.0
+            for arg in args:
+                result *= self._selectivity(arg)
+            return result
+        if op == "or":
+            missing = 1.0
+            for arg in args:
+                missing *= 1.0 - self._selectivity(arg)
+            return 1.0 - missing
+        if op == "not":
+            return 1.0 - self._selectivity(args[0])
+        key = self.resolve(op, args[0])
+        return self._bitmaps[(op, key)][0] / self.size if key is not None else 0.0
+
+    def rowids_of(self, bits, limit=None, after=None):
+        """prop_data rowids of the set bits, in rowid order; only those
+        greater than ``after``, if given."""
+        if after is not None:
+            bits &= ~((1 << bisect_right(self.rowids, after)) - 1)
+        result = []
+        while bits and (limit is None or len(result) < limit):
+            lowest = bits & -bits
+            result.append(self.rowids[lowest.bit_length() - 1])
+            bits ^= lowest
+        return result
+
+    def _at_least(self, facet, minimum):
+        values = [v for v in self.values(facet) if _NUMBER.fullmatch(v) and float(v) >= minimum]
+        return ("or", *((facet, v) for v in values))
+
+    def _stored(self, facet, value):
+        # Only values SQL would match as written: normalized, no labels
+        key = _key(value)
+        return key if (facet, key) in self._bitmaps else None
+
+    def query_for_filters(self, filters):
+        """``(query, complete)`` for a ``final_text_filters`` list.
+
+        Follows PropertyQueryBuilder's semantics, so results don't depend on
+        which engine answers. ``query`` covers the filters a bitmap can
+        answer; ``complete`` is False if others (budget, area, keywords,
+        values the bitmaps don't hold) remain for SQL, in which case
+        ``query`` only narrows the candidates.
+        """
+        parts, complete = [], True
+        for filter_item in filters or []:
+            if not isinstance(filter_item, dict):
+                continue
+            facet, value = filter_item.get("type"), filter_item.get("value")
+            if value in (None, [], {}, ""):
+                continue
+            values = value if isinstance(value, list) else [value]
+            if facet not in self._values or isinstance(value, dict):
+                complete = False
+                continue
+            if facet == "TRANSACT_TYPE":
+                # The builder ignores non-numeric transaction types
+                values = [v for v in values if str(v).strip().isdigit()]
+                if not values:
+                    continue
+            if facet in ("BEDROOM_NUM", "BATHROOM_NUM"):
+                options = []
+                for v in values:
+                    match = _NUMBER.search(str(v))
+                    if not match:
+                        continue
+                    num = int(float(match.group()))
+                    # Bathroom options are all "at least N"
+                    if "+" in str(v) or facet == "BATHROOM_NUM":
+                        options.append(self._at_least(facet, num))
+                    else:
+                        options.append((facet, str(num)))
+                if not options:
+                    complete = False
+                    continue
+                parts.append(("or", *options))
+            elif facet == "AMENITIES":
+                # Every requested amenity must be present; labels resolve
+                # through facets_amenities as in the builder
+                for v in values:
+                    if self.resolve(facet, v) is None:
+                        complete = False
+                    else:
+                        parts.append((facet, v))
+            elif facet in MULTI_VALUED_FACETS:
+                # The builder compares the whole column text
+                complete = False
+            else:
+                stored = [self._stored(facet, v) for v in values]
+                if None in stored:
+                    # SQL decides what an unknown value matches
+                    complete = False
+                    continue
+                parts.append(("or", *((facet, key) for key in stored)))
+        return ("and", *parts), complete
@@ -0,0 +1,174 @@
+"""Materialized listing counts per facet value, per city and transaction type.
+
+``facet_counts`` holds one row per (source file, CITY, TRANSACT_TYPE, facet,
+value), so the filter panel's "(123)" counts are a small SUM over this table
+instead of a GROUP BY over prop_data. Counts use the same listing
+exclusions and value semantics as the search (``"2+"`` bathrooms counts
+listings with at least two, ``"9+ BHK"`` at least nine bedrooms), and rows
+are replaced per ``source_city``, so table_create.py only recounts the
+cities it reloaded.
+"""
+import math
+import sqlite3
+from collections import Counter
+
+from .query_builder import PropertyQueryBuilder, prepare_connection
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS facet_counts (
+        source_city TEXT NOT NULL,
+        city TEXT,
+        transact_type INTEGER,
+        facet TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_facet_counts_facet ON facet_counts(facet, city, transact_type)",
+    "CREATE INDEX IF NOT EXISTS idx_facet_counts_source_city ON facet_counts(source_city)",
+]
+
+FACETS = ["CITY", "TRANSACT_TYPE", "PROPERTY_TYPE", "BEDROOM_NUM", "BATHROOM_NUM", "AMENITIES"]
+MAX_BEDROOM_OPTION = 9
+MAX_BATHROOM_OPTION = 5
+
+
+def ensure_schema(conn):
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+
+def is_built(conn):
+    try:
+        return conn.execute("SELECT 1 FROM facet_counts LIMIT 1").fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else int(number)
+
+
+def _facet_values(row, amenity_labels):
+    """(facet, value) pairs a listing counts towards, as filter values."""
+    if row["CITY"] is not None:
+        yield "CITY", str(row["CITY"])
+    transact_type = _number(row["TRANSACT_TYPE"])
+    if transact_type is not None:
+        yield "TRANSACT_TYPE", str(transact_type)
+    if row["PROPERTY_TYPE"] is not None:
+        yield "PROPERTY_TYPE", str(row["PROPERTY_TYPE"])
+    bedrooms = _number(row["BEDROOM_NUM"])
+    if bedrooms is not None:
+        if bedrooms <= MAX_BEDROOM_OPTION:
+            yield "BEDROOM_NUM", f"{bedrooms} BHK"
+        if bedrooms >= MAX_BEDROOM_OPTION:
+            yield "BEDROOM_NUM", f"{MAX_BEDROOM_OPTION}+ BHK"
+    bathrooms = _number(row["BATHROOM_NUM"])
+    if bathrooms is not None:
+        for minimum in range(1, min(bathrooms, MAX_BATHROOM_OPTION) + 1):
+            yield "BATHROOM_NUM", f"{minimum}+"
+    if row["AMENITIES"]:
+        for amenity_id in dict.fromkeys(str(row["AMENITIES"]).replace(" ", "").split(",")):
+            if amenity_id:
+                yield "AMENITIES", amenity_labels.get(amenity_id, amenity_id)
+
+
+def refresh(conn, cities=None):
+    """Recounts the given source cities (all of them if None) and drops
+    counts of cities no longer in prop_data. Runs in the caller's
+    transaction; returns the number of rows written."""
+    ensure_schema(conn)
+    prepare_connection(conn)
+    builder = PropertyQueryBuilder.for_connection(conn)
+    try:
+        amenity_labels = {
+            str(amenity_id): str(label)
+            for amenity_id, label in conn.execute("SELECT id, label FROM facets_amenities")
+        }
+    except sqlite3.OperationalError:
+        amenity_labels = {}
+
+    present = [row[0] for row in conn.execute("SELECT DISTINCT source_city FROM prop_data")]
+    conn.execute(
+        f"DELETE FROM facet_counts WHERE source_city NOT IN ({', '.join('?' for _ in present)})",
+        present,
+    )
+    columns = ", ".join(
+        column if column in builder.columns else f"NULL AS {column}" for column in FACETS
+    )
+    where_clause, params = builder.where([])
+    written = 0
+    for source_city in present if cities is None else [c for c in cities if c in present]:
+        counts = Counter()
+        cursor = conn.execute(
+            f"SELECT {columns} FROM prop_data WHERE source_city = ? AND {where_clause}",
+            [source_city, *params],
+        )
+        cursor.row_factory = sqlite3.Row
+        for row in cursor:
+            city, transact_type = row["CITY"], _number(row["TRANSACT_TYPE"])
+            for facet, value in _facet_values(row, amenity_labels):
+                counts[(city, transact_type, facet, value)] += 1
+
+        conn.execute("DELETE FROM facet_counts WHERE source_city = ?", (source_city,))
+        conn.executemany(
+            "INSERT INTO facet_counts (source_city, city, transact_type, facet, value, count) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(source_city, *key, count) for key, count in counts.items()],
+        )
+        written += len(counts)
+    return written
+
+
+def _filter_values(filters, facet):
+    for filter_item in filters or []:
+        if isinstance(filter_item, dict) and filter_item.get("type") == facet:
+            value = filter_item.get("value")
+            return [v for v in (value if isinstance(value, list) else [value]) if v not in (None, "")]
+    return []
+
+
+def conditions(filters):
+    """The part of ``filters`` counts depend on: ``(cities, transact_types)``,
+    normalized so it can be used as a cache key."""
+    cities = tuple(sorted({str(v) for v in _filter_values(filters, "CITY")}))
+    transact_types = tuple(sorted({_number(v) for v in _filter_values(filters, "TRANSACT_TYPE")} - {None}))
+    return cities, transact_types
+
+
+def counts(conn, filters=None):
+    """``{facet: {value: count}}`` conditioned on the CITY and TRANSACT_TYPE
+    of ``filters``.
+
+    A facet is never narrowed by its own selection, so the city facet still
+    shows every city for the chosen transaction type. Other filters don't
+    narrow the counts; those dimensions aren't materialized.
+    """
+    cities, transact_types = conditions(filters)
+    if not is_built(conn):
+        # Database loaded before facet counts existed
+        return {facet: {} for facet in FACETS}
+
+    result = {}
+    for facet in FACETS:
+        where, params = ["facet = ?"], [facet]
+        if cities and facet != "CITY":
+            where.append(f"city IN ({', '.join('?' for _ in cities)})")
+            params += cities
+        if transact_types and facet != "TRANSACT_TYPE":
+            where.append(f"transact_type IN ({', '.join('?' for _ in transact_types)})")
+            params += transact_types
+        rows = conn.execute(f"""
+            SELECT value, SUM(count)
+            FROM facet_counts
+            WHERE {' AND '.join(where)}
+            GROUP BY value
+            ORDER BY SUM(count) DESC
+        """, params)
+        result[facet] = {value: total for value, total in rows}
+    return result
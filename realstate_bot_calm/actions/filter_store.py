@@ -0,0 +1,296 @@
+"""Current search filters per sender, shared by the extractor, actions and API.
+
+``current_filters`` holds exactly one row per sender and is what every
+reader consults. Each write is also appended to ``saved_preferences``, which
+stays as the history log and is compacted to the last few entries per
+sender every ``COMPACT_EVERY`` writes.
+"""
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+FILTERS_SLOT = 'final_text_filters'
+HISTORY_KEEP_LAST = 20
+COMPACT_EVERY = 50
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS current_filters (
+        sender_id TEXT PRIMARY KEY,
+        filters TEXT NOT NULL,
+        filled_by TEXT,
+        updated_at FLOAT NOT NULL
+    )''',
+    '''
+    CREATE TABLE IF NOT EXISTS saved_preferences (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender_id VARCHAR(255) NOT NULL,
+        type_name VARCHAR(255) NOT NULL,
+        timestamp FLOAT,
+        intent_name VARCHAR(255),
+        action_name VARCHAR(255),
+        data TEXT
+    )''',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_saved_preferences_sender_action_ts
+    ON saved_preferences(sender_id, action_name, timestamp)''',
+]
+
+_writes_since_compaction = 0
+
+
+def ensure_schema(conn):
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+
+
+def _load_legacy_filters(conn, sender_id):
+    # Senders whose last write predates current_filters only have history
+    row = conn.execute('''
+        SELECT data
+        FROM saved_preferences
+        WHERE sender_id = ?
+          AND action_name = ?
+          AND type_name = 'slot'
+        ORDER BY timestamp DESC
+        LIMIT 1
+    ''', (sender_id, FILTERS_SLOT)).fetchone()
+    if not row or not row[0]:
+        return []
+    return json.loads(row[0]).get('value', []) or []
+
+
+def load_filters(conn, sender_id):
+    """Returns the sender's current filter list (``[]`` if none)."""
+    try:
+        row = conn.execute(
+            'SELECT filters FROM current_filters WHERE sender_id = ?', (sender_id,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    if row is not None:
+        return json.loads(row[0])
+    try:
+        return _load_legacy_filters(conn, sender_id)
+    except (sqlite3.OperationalError, json.JSONDecodeError):
+        return []
+
+
+def _history_entry(filters, filled_by, metadata, timestamp):
+    return {
+        'event': 'slot',
+        'timestamp': timestamp,
+        'metadata': metadata or {},
+        'name': FILTERS_SLOT,
+        'value': filters,
+        'filled_by': filled_by,
+    }
+
+
+def _write_filters(conn, sender_id, filters, filled_by, metadata, timestamp):
+    # A write never replaces a newer one: the write-behind queue can flush
+    # after an API edit made since the put()
+    conn.execute('''
+        INSERT INTO current_filters (sender_id, filters, filled_by, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(sender_id) DO UPDATE SET
+            filters = excluded.filters,
+            filled_by = excluded.filled_by,
+            updated_at = excluded.updated_at
+        WHERE excluded.updated_at >= current_filters.updated_at
+    ''', (sender_id, json.dumps(filters), filled_by, timestamp))
+    conn.execute('''
+        INSERT INTO saved_preferences (sender_id, type_name, timestamp, action_name, data)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (
+        sender_id, 'slot', timestamp, FILTERS_SLOT,
+        json.dumps(_history_entry(filters, filled_by, metadata, timestamp))
+    ))
+
+
+def _count_writes(conn, count):
+    global _writes_since_compaction
+
+    _writes_since_compaction += count
+    if _writes_since_compaction >= COMPACT_EVERY:
+        _writes_since_compaction = 0
+        compact_history(conn)
+
+
+def save_filters(conn, sender_id, filters, filled_by, metadata=None, timestamp=None):
+    """Replaces the sender's current filters and logs the change to history.
+
+    Both writes happen in one transaction, committed before returning.
+    """
+    with conn:
+        _write_filters(conn, sender_id, filters or [], filled_by, metadata, timestamp or time.time())
+    _count_writes(conn, 1)
+
+
+def save_filters_batch(conn, writes):
+    """Applies ``(sender_id, filters, filled_by, metadata, timestamp)`` tuples
+    in order, in a single transaction."""
+    with conn:
+        for sender_id, filters, filled_by, metadata, timestamp in writes:
+            _write_filters(conn, sender_id, filters or [], filled_by, metadata, timestamp or time.time())
+    _count_writes(conn, len(writes))
+
+
+def compact_history(conn, keep_last=HISTORY_KEEP_LAST):
+    """Drops all but the newest ``keep_last`` history rows of every sender."""
+    with conn:
+        deleted = conn.execute('''
+            DELETE FROM saved_preferences
+            WHERE action_name = ?
+              AND id IN (
+                  SELECT id FROM (
+                      SELECT id,
+                             ROW_NUMBER() OVER (
+                                 PARTITION BY sender_id ORDER BY timestamp DESC, id DESC
+                             ) AS position
+                      FROM saved_preferences
+                      WHERE action_name = ?
+                  )
+                  WHERE position > ?
+              )
+        ''', (FILTERS_SLOT, FILTERS_SLOT, keep_last)).rowcount
+    return deleted
+
+
+class CachedFilterStore:
+    """Per-sender filter cache with write-behind persistence.
+
+    Reads are served from a bounded LRU. A hit costs one primary-key lookup
+    of ``updated_at`` on a connection kept open, so edits made through the
+    API are still picked up; a miss loads the filters themselves. Writes
+    update the cache immediately and are queued for a background thread,
+    which persists everything queued so far in one transaction, so callers
+    never wait on SQLite.
+    """
+
+    def __init__(self, db_path, max_senders=10000):
+        self.db_path = db_path
+        self.max_senders = max_senders
+        self._filters = OrderedDict()  # sender_id -> (filters, updated_at)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._read_lock = threading.Lock()
+        self._read_conn = None
+        self._writing = False
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name='filter-store-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _reader(self):
+        # Caller holds _read_lock
+        if self._read_conn is None:
+            self._read_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        return self._read_conn
+
+    def _stored_at(self, sender_id):
+        with self._read_lock:
+            try:
+                row = self._reader().execute(
+                    'SELECT updated_at FROM current_filters WHERE sender_id = ?', (sender_id,)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                return None
+        return row[0] if row else None
+
+    def get(self, sender_id):
+        with self._lock:
+            cached = self._filters.get(sender_id)
+            if cached is None:
+                # An evicted sender may still have a write waiting to be flushed
+                for pending in reversed(self._pending):
+                    if pending[0] == sender_id:
+                        cached = (pending[1], pending[4])
+                        break
+
+        if cached is not None:
+            stored_at = self._stored_at(sender_id)
+            if stored_at is None or stored_at <= cached[1]:
+                with self._lock:
+                    if sender_id in self._filters:
+                        self._filters.move_to_end(sender_id)
+                return json.loads(json.dumps(cached[0]))
+
+        stored_at = self._stored_at(sender_id) or 0.0
+        with self._read_lock:
+            filters = load_filters(self._reader(), sender_id)
+        with self._lock:
+            current = self._filters.get(sender_id)
+            if current is None or current[1] < stored_at:
+                self._remember(sender_id, filters, stored_at)
+        return filters
+
+    def put(self, sender_id, filters, filled_by, metadata=None, timestamp=None):
+        filters = filters or []
+        timestamp = timestamp or time.time()
+        with self._lock:
+            self._remember(sender_id, filters, timestamp)
+            self._pending.append((sender_id, filters, filled_by, metadata, timestamp))
+            self._wakeup.notify()
+
+    def _remember(self, sender_id, filters, updated_at):
+        self._filters[sender_id] = (filters, updated_at)
+        self._filters.move_to_end(sender_id)
+        while len(self._filters) > self.max_senders:
+            self._filters.popitem(last=False)
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA busy_timeout = 5000')
+        try:
+            while True:
+                with self._lock:
+                    while not self._pending and not self._closed:
+                        self._wakeup.wait()
+                    if not self._pending and self._closed:
+                        return
+                    writes, self._pending = self._pending, []
+                    self._writing = True
+                try:
+                    save_filters_batch(conn, writes)
+                    with self._lock:
+                        self._writing = False
+                except sqlite3.Error as e:
+                    logger.error(f"Error persisting {len(writes)} filter update(s): {e}")
+                    with self._lock:
+                        # Keep them, ahead of anything queued meanwhile, for the next round
+                        self._pending = writes + self._pending
+                        self._writing = False
+                    time.sleep(0.5)
+        finally:
+            conn.close()
+
+    def flush(self, timeout=5.0):
+        """Blocks until everything queued so far has been written."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._pending and not self._writing:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._writer.join(timeout=5.0)
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
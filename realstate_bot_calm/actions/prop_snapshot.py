@@ -0,0 +1,125 @@
+"""Columnar snapshot of prop_data as an Arrow IPC file.
+
+table_create.py writes it next to the database after each ingest. Reading
+memory-maps the file, so selecting a few columns of every listing costs no
+SQLite row decoding and no copy. pyarrow is optional: without it
+``write_snapshot`` is skipped and ``load_snapshot`` returns None, and
+callers stay on SQLite.
+"""
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # pyarrow is optional
+    pa = None
+
+SNAPSHOT_NAME = "prop_data.arrow"
+VERSION_KEY = b"prop_data_version"
+FORMAT_KEY = b"snapshot_format"
+# 2: adds ROWID_COLUMN; older snapshots count as stale
+SNAPSHOT_FORMAT = b"2"
+# prop_data's rowid, so rows can be matched back to SQLite
+ROWID_COLUMN = "_rowid"
+BATCH_SIZE = 50000
+
+
+def available():
+    return pa is not None
+
+
+def snapshot_path(db_path):
+    return Path(db_path).with_name(SNAPSHOT_NAME)
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _arrow_schema(conn, columns):
+    # SQLite columns can hold mixed storage classes; one pass decides a
+    # single Arrow type per column (any text -> string, else any real ->
+    # float64, else int64; all-NULL columns become string).
+    probes = []
+    for column in columns:
+        quoted = _quote(column)
+        probes += [
+            f"MAX(typeof({quoted}) IN ('text', 'blob'))",
+            f"MAX(typeof({quoted}) = 'real')",
+            f"MAX(typeof({quoted}) = 'integer')",
+        ]
+    row = conn.execute(f"SELECT {', '.join(probes)} FROM prop_data").fetchone()
+    fields = []
+    for i, column in enumerate(columns):
+        has_text, has_real, has_int = row[3 * i:3 * i + 3]
+        if has_text or not (has_real or has_int):
+            arrow_type = pa.string()
+        elif has_real:
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.int64()
+        fields.append(pa.field(column, arrow_type))
+    return pa.schema(fields)
+
+
+def _to_array(values, arrow_type):
+    if arrow_type == pa.string():
+        values = [None if v is None else str(v) for v in values]
+    return pa.array(values, type=arrow_type)
+
+
+def write_snapshot(conn, path, version, batch_size=BATCH_SIZE):
+    """Writes prop_data to ``path`` in record batches of ``batch_size`` rows;
+    returns the row count, or None without pyarrow.
+
+    The file is written beside ``path`` and renamed over it, so readers
+    never see a partial snapshot.
+    """
+    if pa is None:
+        return None
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(prop_data)")]
+    schema = pa.schema(
+        [pa.field(ROWID_COLUMN, pa.int64()), *_arrow_schema(conn, columns)],
+        metadata={VERSION_KEY: str(version).encode(), FORMAT_KEY: SNAPSHOT_FORMAT},
+    )
+
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    rows = 0
+    cursor = conn.execute(f"SELECT rowid, {', '.join(_quote(c) for c in columns)} FROM prop_data ORDER BY rowid")
+    with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            arrays = [_to_array(values, field.type) for values, field in zip(zip(*batch), schema)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            rows += len(batch)
+    tmp_path.replace(path)
+    return rows
+
+
+def snapshot_version(path):
+    """The prop_data version a snapshot was written from, or None (also for
+    snapshots in an older format)."""
+    if pa is None or not Path(path).exists():
+        return None
+    with pa.memory_map(str(path), "r") as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    version = metadata.get(VERSION_KEY)
+    if version is None or metadata.get(FORMAT_KEY) != SNAPSHOT_FORMAT:
+        return None
+    return version.decode()
+
+
+def load_snapshot(path, columns=None):
+    """Returns the snapshot as a ``pyarrow.Table`` backed by a memory map.
+
+    ``columns`` limits the table to those columns; buffers are only paged in
+    as they are read. Returns None without pyarrow or without a snapshot.
+    """
+    if pa is None or not Path(path).exists():
+        return None
+    source = pa.memory_map(str(path), "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns else table
@@ -0,0 +1,380 @@
+"""Bound-parameter SQL for the extractor's filter schema.
+
+Every filter type the GeminiEntityExtractor emits (see ``filter_data`` in
+simple_entity_extractor.py) maps to one parenthesised condition, and the
+conditions are ANDed together with the listing-quality exclusions. Values
+are always bound, and IN lists are padded to a few fixed sizes so the same
+SQL text repeats and sqlite3's per-connection statement cache can reuse
+the prepared statement.
+"""
+import base64
+import hashlib
+import json
+import math
+import re
+import sqlite3
+
+from . import text_search
+
+CARD_COLUMNS = [
+    "PRICE", "PHOTO_URL", "PROP_HEADING", "BEDROOM_NUM", "BATHROOM_NUM",
+    "PROPERTY_TYPE", "CITY", "BUILTUP_SQFT", "PROP_ID",
+]
+
+# Listings without these can't be shown as a card
+REQUIRED_COLUMNS = [
+    "PHOTO_URL", "PROP_HEADING", "BEDROOM_NUM", "BATHROOM_NUM",
+    "PROPERTY_TYPE", "LOCALITY", "BUILTUP_SQFT",
+]
+
+IN_LIST_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+# Free-text filter: matched against the FTS index rather than a column
+KEYWORDS_FILTER = "KEYWORDS"
+
+# Result orderings; "relevance" is BM25 rank with free text, else table order
+SORT_ORDERS = ("relevance", "price_low", "price_high", "price_per_sqft", "newest")
+DEFAULT_SORT = "relevance"
+# Posting-date columns "newest" sorts by, if prop_data has one
+RECENCY_COLUMNS = ["POSTING_DATE", "POSTED_ON", "REGISTER_DATE"]
+
+_UNITS = {
+    "cr": 10_000_000, "crore": 10_000_000, "crores": 10_000_000,
+    "l": 100_000, "lac": 100_000, "lacs": 100_000, "lakh": 100_000, "lakhs": 100_000,
+    "k": 1_000, "thousand": 1_000,
+}
+_AMOUNT = re.compile(r"(\d+(?:\.\d+)?)\s*(crores?|cr|lakhs?|lacs?|l|k|thousand)?\b", re.IGNORECASE)
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def parse_price_range(text):
+    """Parses listing prices such as ``"1.2 Cr"``, ``"45 L"``, ``"₹ 35,000"``
+    or ``"85 L - 1.1 Cr"`` into rupees as ``(low, high)``.
+
+    A unit given only after the second number of a range applies to both
+    (``"1.2 - 1.5 Cr"``). Returns ``(None, None)`` for "Price on Request"
+    and anything else without a number.
+    """
+    if text is None:
+        return None, None
+    if isinstance(text, (int, float)):
+        if isinstance(text, float) and math.isnan(text):
+            return None, None
+        return float(text), float(text)
+
+    matches = _AMOUNT.findall(str(text).replace(",", ""))
+    if not matches:
+        return None, None
+    trailing_unit = matches[-1][1]
+    values = []
+    for number, unit in matches[:2]:
+        unit = (unit or trailing_unit or "").lower()
+        values.append(float(number) * _UNITS.get(unit, 1))
+    return min(values), max(values)
+
+
+def parse_price(text):
+    return parse_price_range(text)[0]
+
+
+def parse_area(text):
+    """Built-up area in sq. ft. from a number or text like ``"1,250 sqft"``."""
+    if text is None:
+        return None
+    if isinstance(text, (int, float)):
+        return None if isinstance(text, float) and math.isnan(text) else float(text)
+    match = _NUMBER.search(str(text).replace(",", ""))
+    return float(match.group()) if match else None
+
+
+def prepare_connection(conn):
+    """Registers the SQL functions the builder may fall back to."""
+    conn.create_function("price_value", 1, parse_price, deterministic=True)
+    return conn
+
+
+def _bucketed(values):
+    # Repeat the last value up to the next bucket size so that queries with
+    # 3 or 4 cities share one SQL text (and prepared statement).
+    size = next((bucket for bucket in IN_LIST_BUCKETS if bucket >= len(values)), len(values))
+    return list(values) + [values[-1]] * (size - len(values))
+
+
+def _in_clause(column, values):
+    values = _bucketed(values)
+    return f"{column} IN ({', '.join('?' for _ in values)})", values
+
+
+def _range_bounds(value, min_keys, max_keys):
+    if not isinstance(value, dict):
+        return None, None
+    low = next((value[key] for key in min_keys if value.get(key) is not None), None)
+    high = next((value[key] for key in max_keys if value.get(key) is not None), None)
+    try:
+        low = float(low) if low is not None else None
+        high = float(high) if high is not None else None
+    except (TypeError, ValueError):
+        return None, None
+    if low is not None and high is not None and low > high:
+        low, high = high, low
+    return low, high
+
+
+class PropertyQueryBuilder:
+    """Turns a ``final_text_filters`` list into ``(sql, params)`` over prop_data.
+
+    ``columns`` is the set of columns prop_data actually has; numeric
+    ``PRICE_VALUE`` / ``AREA_VALUE`` columns are used when the ingest
+    created them, otherwise the builder parses the text columns in SQL.
+    Free text (``KEYWORDS`` filters or ``text=``) is ranked with BM25 over
+    the ``fts_columns`` of the prop_fts index, when there is one.
+    """
+
+    def __init__(self, columns, amenity_ids=None, fts_columns=None):
+        self.columns = set(columns)
+        # Amenity label -> id as used in prop_data.AMENITIES (facets_amenities)
+        self.amenity_ids = amenity_ids or {}
+        self.fts_columns = list(fts_columns or [])
+
+    @classmethod
+    def for_connection(cls, conn):
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(prop_data)")]
+        try:
+            amenity_ids = {
+                str(label).strip().lower(): str(amenity_id)
+                for amenity_id, label in conn.execute("SELECT id, label FROM facets_amenities")
+            }
+        except sqlite3.OperationalError:
+            amenity_ids = {}
+        return cls(columns, amenity_ids, text_search.index_columns(conn))
+
+    @property
+    def price_expr(self):
+        return "PRICE_VALUE" if "PRICE_VALUE" in self.columns else "price_value(PRICE)"
+
+    @property
+    def area_expr(self):
+        return "AREA_VALUE" if "AREA_VALUE" in self.columns else "BUILTUP_SQFT"
+
+    def _bedrooms(self, values):
+        exact, minimum = [], None
+        for v in values:
+            match = _NUMBER.search(str(v))
+            if not match:
+                continue
+            num = int(float(match.group()))
+            if "+" in str(v):
+                minimum = num if minimum is None else min(minimum, num)
+            else:
+                exact.append(num)
+        parts, params = [], []
+        if exact:
+            clause, bound = _in_clause("BEDROOM_NUM", sorted(set(exact)))
+            parts.append(clause)
+            params += bound
+        if minimum is not None:
+            parts.append("BEDROOM_NUM >= ?")
+            params.append(minimum)
+        return " OR ".join(parts), params
+
+    def _bathrooms(self, values):
+        # Options are "1+", "2+", ...: at least that many bathrooms
+        counts = []
+        for v in values:
+            match = _NUMBER.search(str(v))
+            if match:
+                counts.append(int(float(match.group())))
+        if not counts:
+            return "", []
+        return "BATHROOM_NUM >= ?", [min(counts)]
+
+    def _range(self, expr, low, high):
+        parts, params = [], []
+        if low is not None:
+            parts.append(f"{expr} >= ?")
+            params.append(low)
+        if high is not None:
+            parts.append(f"{expr} <= ?")
+            params.append(high)
+        return " AND ".join(parts), params
+
+    def _amenities(self, values):
+        # Every requested amenity must be present. AMENITIES holds a
+        # comma-separated id list; labels missing from the facet table are
+        # matched as text.
+        parts, params = [], []
+        for label in values:
+            amenity_id = self.amenity_ids.get(str(label).strip().lower())
+            if amenity_id is not None:
+                parts.append("(',' || REPLACE(AMENITIES, ' ', '') || ',') LIKE ?")
+                params.append(f"%,{amenity_id},%")
+            else:
+                parts.append("AMENITIES LIKE ?")
+                params.append(f"%{label}%")
+        return " AND ".join(parts), params
+
+    def _condition(self, filter_item):
+        col_type = filter_item.get("type")
+        value = filter_item.get("value")
+        if value in (None, [], {}, "") or col_type == KEYWORDS_FILTER:
+            return "", []
+
+        if col_type == "BUDGET":
+            low, high = _range_bounds(value, ("min", "MIN_PRICE"), ("max", "MAX_PRICE"))
+            return self._range(self.price_expr, low, high)
+        if col_type == "AREA_SQFT":
+            low, high = _range_bounds(value, ("min", "MIN_AREA_SQFT"), ("max", "MAX_AREA_SQFT"))
+            return self._range(self.area_expr, low, high)
+
+        values = value if isinstance(value, list) else [value]
+        if col_type == "BEDROOM_NUM":
+            return self._bedrooms(values)
+        if col_type == "BATHROOM_NUM":
+            return self._bathrooms(values)
+        if col_type == "AMENITIES" and "AMENITIES" in self.columns:
+            return self._amenities(values)
+        if col_type == "TRANSACT_TYPE":
+            values = [int(v) for v in values if str(v).strip().isdigit()]
+        if col_type in self.columns and values:
+            return _in_clause(col_type, sorted(set(values), key=str))
+        return "", []
+
+    def where(self, filters, rowids=None):
+        """``(clause, params)`` for ``filters``; ``rowids``, if given, are the
+        only candidates (already narrowed down by facet_bitmaps)."""
+        conditions, params = [], []
+        if rowids:
+            clause, bound = _in_clause("prop_data.rowid", list(rowids))
+            conditions.append(clause)
+            params += bound
+        for filter_item in filters or []:
+            if not isinstance(filter_item, dict):
+                continue
+            clause, bound = self._condition(filter_item)
+            if clause:
+                conditions.append(f"({clause})")
+                params += bound
+
+        exclusions = [f"{column} IS NOT NULL" for column in REQUIRED_COLUMNS]
+        if "PRICE_VALUE" in self.columns:
+            exclusions.append("PRICE_VALUE IS NOT NULL")
+        else:
+            exclusions.append("PRICE != 'Price on Request'")
+        return " AND ".join(conditions + exclusions), params
+
+    def match_expression(self, filters, text=None):
+        if not self.fts_columns:
+            return None
+        if text is None:
+            text = [
+                value
+                for filter_item in filters or []
+                if isinstance(filter_item, dict) and filter_item.get("type") == KEYWORDS_FILTER
+                for value in (filter_item.get("value") if isinstance(filter_item.get("value"), list)
+                              else [filter_item.get("value")])
+                if value
+            ]
+        return text_search.match_expression(text)
+
+    def order_key(self, sort, ranked=False):
+        """``(expr, descending)`` for a SORT_ORDERS entry. Keys that can be
+        NULL are mapped to +/-infinity so those listings come last."""
+        if sort == "price_low":
+            return self._not_null(self.price_expr, "PRICE_VALUE" in self.columns), False
+        if sort == "price_high":
+            return self._not_null(self.price_expr, "PRICE_VALUE" in self.columns, True), True
+        if sort == "price_per_sqft":
+            return self._not_null(f"{self.price_expr} / NULLIF({self.area_expr}, 0)"), False
+        if sort == "newest":
+            column = next((c for c in RECENCY_COLUMNS if c in self.columns), None)
+            # Without a posting date, the most recently loaded listings first
+            return (self._not_null(column, descending=True) if column else "prop_data.rowid"), True
+        return ("matches.text_rank" if ranked else "prop_data.rowid"), False
+
+    @staticmethod
+    def _not_null(expr, never_null=False, descending=False):
+        if never_null:
+            return expr
+        return f"IFNULL({expr}, {'-9e999' if descending else '9e999'})"
+
+    def build(self, filters, columns=None, limit=5, text=None, rowids=None, sort=None, after=None):
+        """``(sql, params)`` for up to ``limit`` cards.
+
+        With ``sort`` (one of SORT_ORDERS) the rows are in a stable order,
+        ending in ``sort_key`` and ``row_id`` columns; passing the last row's
+        ``(sort_key, row_id)`` as ``after`` continues from there with a
+        keyset condition, so page 50 costs what page 1 does.
+        """
+        where_clause, params = self.where(filters, rowids)
+        select = ", ".join(columns or CARD_COLUMNS)
+        match = self.match_expression(filters, text)
+        if sort is None:
+            order = "ORDER BY matches.text_rank " if match is not None else ""
+        else:
+            key, descending = self.order_key(sort, ranked=match is not None)
+            select += f", {key} AS sort_key, prop_data.rowid AS row_id"
+            if after is not None:
+                where_clause = f"({key}, prop_data.rowid) {'<' if descending else '>'} (?, ?) AND {where_clause}"
+                params = list(after) + params
+            direction = " DESC" if descending else ""
+            order = f"ORDER BY {key}{direction}, prop_data.rowid{direction} "
+
+        if match is None:
+            sql = f"SELECT {select} FROM prop_data WHERE {where_clause} {order}LIMIT ?"
+            return sql, params + [limit]
+
+        # Rank the text matches, then apply the structured filters to them
+        fts = text_search.FTS_TABLE
+        weights = ", ".join(str(text_search.FTS_COLUMN_WEIGHTS.get(c, 1.0)) for c in self.fts_columns)
+        sql = (
+            f"SELECT {select} FROM prop_data "
+            f"JOIN (SELECT rowid AS fts_rowid, bm25({fts}, {weights}) AS text_rank "
+            f"FROM {fts} WHERE {fts} MATCH ?) AS matches ON prop_data.rowid = matches.fts_rowid "
+            f"WHERE {where_clause} {order}LIMIT ?"
+        )
+        return sql, [match] + params + [limit]
+
+
+def canonical_filters(filters):
+    """``filters`` in a fixed order: by type, with list values sorted, so the
+    same search listed differently compares equal."""
+    def dump(value):
+        return json.dumps(value, sort_keys=True, default=str)
+
+    canonical = []
+    for filter_item in filters or []:
+        if isinstance(filter_item, dict) and isinstance(filter_item.get("value"), list):
+            filter_item = {**filter_item, "value": sorted(filter_item["value"], key=dump)}
+        canonical.append(filter_item)
+    return sorted(
+        canonical,
+        key=lambda f: (str(f.get("type")) if isinstance(f, dict) else "", dump(f)),
+    )
+
+
+def cursor_fingerprint(filters, sort, version=None):
+    """Identifies a result list; a cursor is only valid for the same one.
+    Filter and value order don't matter."""
+    payload = json.dumps([canonical_filters(filters), sort, version], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def encode_cursor(fingerprint, sort_key, row_id):
+    """Opaque continuation token for the row ``(sort_key, row_id)``."""
+    payload = json.dumps([fingerprint, sort_key, row_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, fingerprint):
+    """``(sort_key, row_id)`` from ``encode_cursor``, or None if the cursor
+    is malformed or belongs to other filters, ordering or data."""
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        cursor_fingerprint_, sort_key, row_id = payload
+    except (ValueError, TypeError):
+        return None
+    if cursor_fingerprint_ != fingerprint or not isinstance(row_id, int):
+        return None
+    return sort_key, row_id
@@ -0,0 +1,78 @@
+"""FTS5 full-text index over the descriptive columns of prop_data.
+
+``prop_fts`` is an external-content table: it stores only the index and
+reads column values from prop_data by rowid, so it must be rebuilt whenever
+prop_data's rows change (table_create.py does this in the load transaction).
+"""
+import re
+
+FTS_TABLE = "prop_fts"
+
+# BM25 weight per column, when prop_data has it; a match in the heading or
+# locality counts for more than one in the description.
+FTS_COLUMN_WEIGHTS = {
+    "PROP_HEADING": 4.0,
+    "LOCALITY": 3.0,
+    "SOCIETY_NAME": 3.0,
+    "PROP_NAME": 2.0,
+    "CITY": 1.5,
+    "PROPERTY_TYPE": 1.0,
+    "DESCRIPTION": 1.0,
+    "FORMATTED_LANDMARK_DETAILS": 1.0,
+    "SECONDARY_TAGS": 1.0,
+}
+
+STOP_WORDS = {
+    "a", "an", "and", "any", "are", "at", "for", "i", "in", "is", "me", "my",
+    "near", "of", "on", "or", "show", "some", "the", "to", "want", "with",
+}
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def build_index(conn):
+    """(Re)creates prop_fts over whichever descriptive columns prop_data has
+    and indexes every row; returns the indexed columns.
+
+    Runs inside the caller's transaction, if any.
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(prop_data)")}
+    columns = [column for column in FTS_COLUMN_WEIGHTS if column in existing]
+    conn.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    if not columns:
+        return []
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+            {', '.join(_quote(column) for column in columns)},
+            content='prop_data', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return columns
+
+
+def index_columns(conn):
+    """Columns of prop_fts in index order, or ``[]`` if it doesn't exist."""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({FTS_TABLE})")]
+
+
+def match_expression(text):
+    """FTS5 query for free text: every meaningful word, quoted, ORed.
+
+    BM25 ranks listings matching more (and rarer) words first, so a long
+    phrase still finds partial matches. Returns None if nothing is left.
+    """
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(part) for part in text)
+    tokens = [
+        token for token in dict.fromkeys(_TOKEN.findall(str(text or "").lower()))
+        if len(token) > 1 and token not in STOP_WORDS
+    ]
+    if not tokens:
+        return None
+    return " OR ".join(f'"{token}"' for token in tokens)
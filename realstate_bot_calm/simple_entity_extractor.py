@@ -9,7 +9,6 @@ import requests
 import json
 import sqlite3
 from pathlib import Path
-import pandas as pd
 
 import rasa.shared.utils.io
 from rasa.engine.graph import ExecutionContext, GraphComponent
@@ -24,29 +23,9 @@ from rasa.shared.nlu.training_data.training_data import TrainingData
 
 import google.generativeai as genai
 
-logger = logging.getLogger(__name__)
-
-def GetDataFromDB(query, db_path):
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_path)
-
-    df = pd.read_sql_query(query, conn)
-
-    data = df.to_dict(orient="records")
+from actions import filter_store
 
-    try:
-        data = data[0]["data"]
-        print("RESPONSE RAW:", data)
-        # Convert the JSON string to a Python dictionary
-        data = json.loads(data)["value"]
-
-    except Exception as e:
-        print("REPONSE EX:", e)
-        data = []
-
-    conn.close()
-
-    return data
+logger = logging.getLogger(__name__)
 
 @DefaultV1Recipe.register(
     DefaultV1Recipe.ComponentType.ENTITY_EXTRACTOR, is_trainable=False
@@ -73,6 +52,16 @@ class GeminiEntityExtractor(GraphComponent, EntityExtractorMixin):
         self._timeout = self.component_config.get("timeout")
         self._db_path = self.component_config.get("db_path")  # Retrieve db_path from config
 
+        try:
+            conn = sqlite3.connect(self._db_path)
+            filter_store.ensure_schema(conn)
+            conn.close()
+        except Exception as e:
+            logger.error(f"GeminiEntityExtractor: Error preparing filter tables: {e}")
+
+        # Latest filters per sender; persisted to SQLite off the request path
+        self._filter_store = filter_store.CachedFilterStore(self._db_path)
+
         if not self._api_key:
             rasa.shared.utils.io.raise_warning(
                 "GeminiEntityExtractor: 'api_key' is not configured. "
@@ -144,6 +133,7 @@ class GeminiEntityExtractor(GraphComponent, EntityExtractorMixin):
                         {"type": "TRANSACT_TYPE", "options": [1, 2], "desc": "Transaction type (1 = Sale, 2 = Rent)"},
                         {"type": "CITY", "options": ["Secunderabad", "Hyderabad", "Kolkata South", "Kolkata North", "Kolkata Central", "Kolkata East", "Kolkata West", "Mumbai Beyond Thane", "Navi Mumbai", "Thane", "Mumbai Harbour", "South Mumbai", "Central Mumbai suburbs", "Mumbai South West", "Mumbai Andheri-Dahisar", "Mira Road And Beyond", "Gurgaon"], "desc": "List of Locations"},
                         {"type": "AMENITIES", "options": ["Swimming Pool", "Power Back-up", "Club house / Community Center", "Feng Shui / Vaastu Compliant", "Park", "Private Garden / Terrace", "Security Personnel", "Centrally Air Conditioned", "ATM", "Fitness Centre / GYM", "Cafeteria / Food Court", "Bar / Lounge", "Conference room", "Security / Fire Alarm", "Visitor Parking", "Intercom Facility", "Lift(s)", "Service / Goods Lift", "Maintenance Staff", "Water Storage", "Waste Disposal", "Rain Water Harvesting", "Access to High Speed Internet", "Bank Attached Property", "Piped-gas", "Water purifier", "Shopping Centre", "WheelChair Accessibility", "DG Availability", "CCTV Surveillance", "Grade A Building", "Grocery Shop", "Near Bank"], "desc": "Available facilities (e.g., Gym, Pool, Lift)"},
+                        {"type": "KEYWORDS", "options": "free text", "desc": "Specific terms with no counterpart above, matched against listing text (e.g., locality, landmark or project names, sea facing)"},
                     ]
 
         valid_filter_types = {f["type"] for f in filter_data}
@@ -154,14 +144,11 @@ class GeminiEntityExtractor(GraphComponent, EntityExtractorMixin):
             if not text:
                 continue
 
-            query = f"""SELECT *
-                            FROM saved_preferences
-                            WHERE sender_id = '{sender_id}'
-                            AND action_name = 'final_text_filters'
-                            ORDER BY timestamp DESC
-                            LIMIT 1; """
-
-            saved_final_text_filters = GetDataFromDB(query, self._db_path)
+            try:
+                saved_final_text_filters = self._filter_store.get(sender_id)
+            except Exception as e:
+                logger.error(f"Error loading final_text_filters from database: {e}")
+                saved_final_text_filters = []
 
             prompt = (
                f""" You task is to analyze this user's message: "{text}".
@@ -197,7 +184,8 @@ class GeminiEntityExtractor(GraphComponent, EntityExtractorMixin):
 
                     5. Ignore Ambiguity:
                     - Vague terms (e.g., "nice", "spacious", "cheap", "modern") → NO FILTER.
-                    - Subjective phrases (e.g., "near park", "good area") → Ignore unless mapped in schema.
+                    - Subjective phrases (e.g., "good area") → Ignore unless mapped in schema.
+                    - Specific but unmappable terms (e.g., "near Powai lake", "Lodha", "sea facing") → KEYWORDS
 
                     6. Partial Match Handling:
                     - Match root words: "gym" → "Gymnasium"
@@ -276,64 +264,33 @@ class GeminiEntityExtractor(GraphComponent, EntityExtractorMixin):
                 assistant_id = metadata.get("assistant_id", "unknown_assistant")
                 current_timestamp = time.time()
 
-                data_value = {
-                    "event": "slot",
-                    "timestamp": current_timestamp,
-                    "metadata": {
+                self._filter_store.put(
+                    sender_id,
+                    updated_final_text_filters,
+                    filled_by="GeminiEntityExtractor",
+                    metadata={
                         "model_id": model_id,
                         "assistant_id": assistant_id
                     },
-                    "name": "final_text_filters",
-                    "value":  updated_final_text_filters,
-                    "filled_by": "GeminiEntityExtractor"
-                }
+                    timestamp=current_timestamp,
+                )
 
-                data_json = json.dumps(data_value)
+                # Append the final_text_filters as a single entity entry, so
+                # actions can use them straight from the parsed message
+                entities = [
+                    {
+                        "entity": filter_store.FILTERS_SLOT,
+                        "value": updated_final_text_filters,
+                        "confidence": 1.0,
+                        "extractor": self.__class__.__name__
+                    }
+                ]
 
-                conn = None
-                try:
-                    conn = sqlite3.connect(self._db_path)
-                    cursor = conn.cursor()
-                    insert_query = """
-                            INSERT INTO saved_preferences (sender_id, type_name, timestamp, action_name, data)
-                            VALUES (?, ?, ?, ?, ?)
-                        """
-                        #  ON CONFLICT(sender_id, type_name)
-                        #     DO UPDATE SET
-                        #         timestamp = excluded.timestamp,
-                        #         action_name = excluded.action_name,
-                        #         data = excluded.data;
-
-                    cursor.execute(insert_query, (
-                        sender_id,
-                        'slot',
-                        current_timestamp,
-                        'final_text_filters',
-                        data_json
-                    ))
-                    conn.commit()
-                except Exception as e:
-                    logger.error(f"Error saving final_text_filters to database: {e}")
-                finally:
-                    if conn:
-                        conn.close()
-
-                # # Append the final_text_filters as a single entity entry
-                # entities = [
-                #     {
-                #         "entity": "final_text_filters",
-                #         "value": final_text_filters,
-                #         "confidence": 1.0,
-                #         "extractor": self.__class__.__name__
-                #     }
-                # ]
-
-                # message.set(ENTITIES, message.get(ENTITIES, []) + entities, add_to_output=True)
+                message.set(ENTITIES, message.get(ENTITIES, []) + entities, add_to_output=True)
 
                 print("RESPONSE:0", sender_id, saved_final_text_filters)
                 print("RESPONSE:1", response_json)
                 print("RESPONSE:1 response", updated_final_text_filters)
-                print("RESPONSE:3", data_json)
                 # print("RESPONSE:3", prompt)
 
         return messages
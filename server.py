@@ -1,21 +1,63 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-import sqlite3
-import requests
-import json
+from contextlib import asynccontextmanager
 from datetime import datetime
-
-app = Flask(__name__)
-CORS(app, supports_credentials=True, resources={r"/api/*": {"origins": "*"}})
-
-# Database connection
-def get_db_connection():
-    conn = sqlite3.connect('/workspaces/Rasa_challenge/rasa.db')
-    conn.row_factory = sqlite3.Row
-    return conn
-
-# Create favorites table if not exists
-with get_db_connection() as conn:
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+import db_indexes
+from db_pool import ConnectionPool
+from event_stream import EventBroadcaster, fetch_events_since, sse_message
+from http_cache import content_etag, is_not_modified, json_response, make_etag, not_modified_response
+from property_cache import CARD_COLUMNS, MAX_IDS_PER_QUERY, PropertyCardCache, format_property
+import rasa_client
+from rasa_client import RasaClient
+from realstate_bot_calm.actions import facet_bitmaps, facet_counts, filter_store, query_builder
+from realstate_bot_calm.actions.query_builder import PropertyQueryBuilder
+
+logger = logging.getLogger('server')
+
+DB_PATH = '/workspaces/Rasa_challenge/rasa.db'
+RASA_WEBHOOK_URL = os.environ.get('RASA_WEBHOOK_URL', 'http://localhost:5005/webhooks/rest/webhook')
+RASA_CONNECT_TIMEOUT = float(os.environ.get('RASA_CONNECT_TIMEOUT', 5))
+RASA_READ_TIMEOUT = float(os.environ.get('RASA_READ_TIMEOUT', 60))
+# Shared by all API workers on the host: per-sender turn locks and metrics
+RASA_LOCK_DIR = os.environ.get('RASA_LOCK_DIR', rasa_client.DEFAULT_LOCK_DIR)
+
+db_pool = ConnectionPool(DB_PATH, max_size=int(os.environ.get('DB_POOL_SIZE', 8)))
+property_cache = PropertyCardCache(max_size=int(os.environ.get('PROPERTY_CACHE_SIZE', 5000)))
+_search_builder = (None, None)  # (prop_data version, PropertyQueryBuilder)
+_facet_cache = OrderedDict()  # (prop_data version, conditions) -> counts
+_facet_cache_lock = threading.Lock()
+_facet_index = (None, None)  # (prop_data version, FacetBitmapIndex or None)
+_facet_index_lock = threading.Lock()
+
+
+SESSION_PAGE_SIZE = 100
+MAX_CONVERSATION_PAGE = 500
+STREAM_KEEPALIVE_SECONDS = 15
+PROPERTY_CACHE_CONTROL = 'public, max-age=60'
+BOOTSTRAP_CONVERSATION_LIMIT = 50
+MAX_BATCH_PROPERTIES = 200
+SEARCH_PAGE_SIZE = 10
+MAX_SEARCH_RESULTS = 100
+FACET_CACHE_SIZE = 256
+FACETS_CACHE_CONTROL = 'public, max-age=60'
+MAX_COUNT_CANDIDATES = 1000
+
+
+def init_db(conn):
+    # Create favorites table if not exists
     conn.execute('''
         CREATE TABLE IF NOT EXISTS favorites (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -26,286 +68,704 @@ with get_db_connection() as conn:
             UNIQUE(session_id, property_id)
         )
     ''')
+    filter_store.ensure_schema(conn)
     conn.commit()
 
-@app.route('/api/send-message', methods=['POST'])
-def send_message():
-    data = request.json
-    sender_id = data.get('sender_id')
-    message = data.get('message')
 
+async def run_db(fn, *args):
+    """Runs ``fn(conn, *args)`` on a pooled connection in the threadpool.
+
+    SQLite calls block, so they never run on the event loop; the connection
+    is returned to the pool as soon as ``fn`` finishes.
+    """
+    def call():
+        with db_pool.connection() as conn:
+            return fn(conn, *args)
+    return await run_in_threadpool(call)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_db(init_db)
+    # Covers tables created since the last ingest, e.g. Rasa's events. One
+    # worker builds, the rest wait for it; a failure only costs speed
     try:
-        rasa_response = requests.post(
-            'http://localhost:5005/webhooks/rest/webhook',
-            json={
-                'sender': sender_id,
-                'message': message,
-                'stream': True,
-                'input_channel': "web",
-                'metadata': {}
-            }
-        )
-        rasa_response.raise_for_status()
-        messages = rasa_response.json()
-        return jsonify(messages)
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to communicate with Rasa: {e}'}), 500
-
-@app.route('/api/rasa-session', methods=['GET'])
-def get_rasa_session():
+        built = await run_in_threadpool(db_indexes.create_missing_indexes, DB_PATH)
+        if built:
+            logger.info(f"Built indexes: {', '.join(built)}")
+    except sqlite3.Error as e:
+        logger.error(f'Could not build indexes at startup: {e}')
+    # One keep-alive client per worker, shared by every /api/send-message
+    # call; the workers coordinate sender turns through RASA_LOCK_DIR.
+    app.state.rasa_client = RasaClient(
+        RASA_WEBHOOK_URL,
+        connect_timeout=RASA_CONNECT_TIMEOUT,
+        read_timeout=RASA_READ_TIMEOUT,
+        lock_dir=RASA_LOCK_DIR,
+    )
+    app.state.broadcaster = EventBroadcaster(DB_PATH)
+    await app.state.broadcaster.start()
     try:
-        conn = get_db_connection()
-        events = conn.execute('''
-            SELECT sender_id, timestamp, type_name
-            FROM events
-            WHERE type_name = 'session_started'
-            ORDER BY timestamp DESC
-        ''').fetchall()
+        yield
+    finally:
+        await app.state.broadcaster.stop()
+        await app.state.rasa_client.aclose()
+        db_pool.close_all()
 
-        session_map = {}
-        for event in events:
-            if event['sender_id'] not in session_map:
-                session_map[event['sender_id']] = dict(event)  # Convert Row to dict
 
-        deduped_sessions = list(session_map.values())[:100]
-        return jsonify(deduped_sessions)
-    except Exception as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to fetch sessions: {e}'}), 500
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=['*'],
+    allow_credentials=True,
+    allow_methods=['*'],
+    allow_headers=['*'],
+)
 
-@app.route('/api/conversation/<sender_id>', methods=['GET'])
-def get_conversation(sender_id):
-    try:
-        conn = get_db_connection()
-        conversation = conn.execute('''
-            SELECT data, timestamp
-            FROM events
-            WHERE sender_id = ?
-              AND (type_name = 'bot' OR type_name = 'user')
-            ORDER BY timestamp ASC
-        ''', (sender_id,)).fetchall()
-
-        messages = [
-            {
-                'text': json.loads(event['data']).get('text'),
-                'data': json.loads(event['data']).get('data'),
-                'event': json.loads(event['data']).get('event'),
-                'timestamp': event['timestamp']
-            }
-            for event in conversation
-        ]
-        return jsonify(messages)
-    except Exception as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to fetch conversation: {e}'}), 500
 
-@app.route('/api/sessions/<sender_id>/filters', methods=['GET'])
-def get_filters(sender_id):
-    try:
-        conn = get_db_connection()
-        filter_event = conn.execute('''
-            SELECT *
-            FROM saved_preferences
-            WHERE sender_id = ?
-              AND action_name = 'final_text_filters'
-              AND type_name = 'slot'
-            ORDER BY timestamp DESC
-            LIMIT 1
-        ''', (sender_id,)).fetchone()
+def error_response(message, status_code=500):
+    return ORJSONResponse({'error': message}, status_code=status_code)
 
-        if filter_event and filter_event['data']:
-            event_data = json.loads(filter_event['data'])
-            filters = event_data.get('value', [])
-        else:
-            filters = []
 
-        return jsonify({'filters': filters})
-    except Exception as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to fetch filters: {e}'}), 500
+@app.post('/api/send-message')
+async def send_message(request: Request):
+    data = await request.json()
+    sender_id = data.get('sender_id')
+    message = data.get('message')
 
-@app.route('/api/sessions/<sender_id>/filters', methods=['POST'])
-def save_filters(sender_id):
-    filters = request.json.get('filters')
+    if not sender_id:
+        return error_response('sender_id required', 400)
+
+    try:
+        return await request.app.state.rasa_client.send(sender_id, message)
+    except httpx.TimeoutException as e:
+        logger.error(f'Timed out waiting for Rasa: {e}', exc_info=True)
+        return error_response(f'Rasa did not respond in time: {e}', 504)
+    except httpx.HTTPError as e:
+        logger.error(f'Error sending message to Rasa: {e}', exc_info=True)
+        return error_response(f'Failed to communicate with Rasa: {e}')
+
+
+@app.get('/api/send-message/metrics')
+async def get_send_message_metrics(request: Request):
+    # Summed over every API worker on this host
+    return await request.app.state.rasa_client.metrics()
+
+
+def page_cursor(timestamp, tiebreak):
+    # Keyset position of a row: its timestamp plus a unique tiebreaker, so
+    # rows sharing a timestamp at a page boundary are neither skipped nor
+    # repeated
+    return f'{timestamp!r}:{tiebreak}'
+
+
+def parse_page_cursor(cursor, tiebreak_type=str):
+    """``(timestamp, tiebreak)`` from ``page_cursor``; a bare timestamp (the
+    old format) gives ``(timestamp, None)``. Raises ValueError if malformed."""
+    timestamp, _, tiebreak = cursor.partition(':')
+    return float(timestamp), (tiebreak_type(tiebreak) if tiebreak else None)
+
+
+def _keyset_condition(column, tiebreak_column, cursor, op):
+    timestamp, tiebreak = cursor
+    if tiebreak is None:
+        return f'{column} {op} ?', [timestamp]
+    return f'({column}, {tiebreak_column}) {op} (?, ?)', [timestamp, tiebreak]
+
+
+def fetch_rasa_sessions(conn, before=None, limit=SESSION_PAGE_SIZE):
+    # Latest session_started per sender, newest first. The GROUP BY walks the
+    # (type_name, sender_id, timestamp) index, so no row data is read.
+    params = []
+    having = ''
+    if before is not None:
+        condition, params = _keyset_condition('MAX(timestamp)', 'sender_id', before, '<')
+        having = f'HAVING {condition}'
+    params.append(limit)
+
+    sessions = conn.execute(f'''
+        SELECT sender_id, MAX(timestamp) AS timestamp, type_name
+        FROM events
+        WHERE type_name = 'session_started'
+        GROUP BY sender_id
+        {having}
+        ORDER BY timestamp DESC, sender_id DESC
+        LIMIT ?
+    ''', params).fetchall()
+
+    return [
+        {**session, 'cursor': page_cursor(session['timestamp'], session['sender_id'])}
+        for session in map(dict, sessions)
+    ]
+
+
+@app.get('/api/rasa-session')
+async def get_rasa_session(before: str = None, limit: int = SESSION_PAGE_SIZE):
+    # Keyset pagination: pass the ``cursor`` of the last session of the
+    # previous page as ``before`` to get the next one.
+    limit = max(1, min(limit, 500))
+    try:
+        before = parse_page_cursor(before) if before else None
+    except ValueError:
+        return error_response('Invalid before cursor', 400)
     try:
-        conn = get_db_connection()
-        event_data = {
-            'event': 'slot',
-            'timestamp': int(datetime.now().timestamp()),
-            'name': 'final_text_filters',
-            'value': filters,
-            'filled_by': 'WebInterface',
-            'metadata': {
-                'model_id': 'web-interface',
-                'assistant_id': 'property-bot'
-            }
+        return await run_db(fetch_rasa_sessions, before, limit)
+    except Exception as e:
+        logger.error(f'Error fetching sessions: {e}', exc_info=True)
+        return error_response(f'Failed to fetch sessions: {e}')
+
+
+def fetch_conversation(conn, sender_id, since=None, since_id=None, before=None, limit=None):
+    conditions = ["sender_id = ?", "type_name IN ('bot', 'user')"]
+    params = [sender_id]
+    if since is not None:
+        condition, condition_params = _keyset_condition('timestamp', 'id', since, '>')
+        conditions.append(condition)
+        params += condition_params
+    if since_id is not None:
+        conditions.append('id > ?')
+        params.append(since_id)
+    if before is not None:
+        condition, condition_params = _keyset_condition('timestamp', 'id', before, '<')
+        conditions.append(condition)
+        params += condition_params
+
+    # Catch-up reads (``since``/``since_id``) go forwards from the client's
+    # cursor, so a limit returns the oldest missing events and the next
+    # request continues after the last one. Otherwise a limit means the
+    # newest page (or the page before ``before``): read backwards and flip.
+    backwards = bool(limit) and since is None and since_id is None
+    order = 'DESC' if backwards else 'ASC'
+    # A since_id cursor follows id order, so order by id alone
+    order_by = f'id {order}' if since_id is not None else f'timestamp {order}, id {order}'
+    query = f'''
+        SELECT id, data, timestamp
+        FROM events
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {order_by}
+    '''
+    if limit:
+        query += ' LIMIT ?'
+        params.append(limit)
+
+    conversation = conn.execute(query, params).fetchall()
+    if backwards:
+        conversation.reverse()
+
+    messages = []
+    for event in conversation:
+        payload = json.loads(event['data'])
+        messages.append({
+            'id': event['id'],
+            'text': payload.get('text'),
+            'data': payload.get('data'),
+            'event': payload.get('event'),
+            'timestamp': event['timestamp'],
+            'cursor': page_cursor(event['timestamp'], event['id']),
+        })
+    return messages
+
+
+@app.get('/api/conversation/{sender_id}')
+async def get_conversation(sender_id: str, request: Request, since: str = None,
+                           since_id: int = None, before: str = None, limit: int = None):
+    # ``since``/``since_id`` fetch only events newer than what the client has;
+    # ``before`` + ``limit`` pages backwards through older history. ``since``
+    # and ``before`` take a message's ``cursor``.
+    if limit is not None:
+        limit = max(1, min(limit, MAX_CONVERSATION_PAGE))
+    try:
+        since = parse_page_cursor(since, int) if since else None
+        before = parse_page_cursor(before, int) if before else None
+    except ValueError:
+        return error_response('Invalid since/before cursor', 400)
+    try:
+        messages = await run_db(fetch_conversation, sender_id, since, since_id, before, limit)
+        return json_response(request, messages)
+    except Exception as e:
+        logger.error(f'Error fetching conversation: {e}', exc_info=True)
+        return error_response(f'Failed to fetch conversation: {e}')
+
+
+@app.get('/api/conversation/{sender_id}/stream')
+async def stream_conversation(sender_id: str, request: Request, since_id: int = None):
+    """Server-sent events for new user/bot/slot events of one sender.
+
+    Pass ``since_id`` (or let EventSource send Last-Event-ID on reconnect)
+    to replay anything the client missed before live events start.
+    """
+    last_event_id = request.headers.get('last-event-id')
+    if last_event_id and last_event_id.isdigit():
+        since_id = int(last_event_id)
+
+    broadcaster = request.app.state.broadcaster
+    queue = broadcaster.subscribe(sender_id)
+
+    async def event_source():
+        last_sent = since_id or 0
+        try:
+            if since_id is not None:
+                for event in await run_db(fetch_events_since, sender_id, since_id):
+                    yield sse_message(event)
+                    last_sent = event['id']
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event is None:
+                    break
+                # Skip anything the replay above already delivered
+                if event['id'] <= last_sent:
+                    continue
+                yield sse_message(event)
+                last_sent = event['id']
+        finally:
+            broadcaster.unsubscribe(sender_id, queue)
+
+    return StreamingResponse(
+        event_source(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def fetch_filters(conn, sender_id):
+    return filter_store.load_filters(conn, sender_id)
+
+
+@app.get('/api/sessions/{sender_id}/filters')
+async def get_filters(sender_id: str):
+    try:
+        filters = await run_db(fetch_filters, sender_id)
+        return {'filters': filters}
+    except Exception as e:
+        logger.error(f'Error fetching filters: {e}', exc_info=True)
+        return error_response(f'Failed to fetch filters: {e}')
+
+
+def store_filters(conn, sender_id, filters):
+    filter_store.save_filters(
+        conn,
+        sender_id,
+        filters,
+        filled_by='WebInterface',
+        metadata={
+            'model_id': 'web-interface',
+            'assistant_id': 'property-bot'
         }
+    )
+
 
-        conn.execute('''
-            INSERT INTO events (
-                sender_id,
-                type_name,
-                timestamp,
-                data,
-                action_name,
-                value
-            ) VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            sender_id,
-            'slot',
-            event_data['timestamp'],
-            json.dumps(event_data),
-            'final_text_filters',
-            json.dumps(filters)
-        ))
-        conn.commit()
-        return jsonify({'success': True})
+@app.post('/api/sessions/{sender_id}/filters')
+async def save_filters(sender_id: str, request: Request):
+    filters = (await request.json()).get('filters')
+    try:
+        await run_db(store_filters, sender_id, filters)
+        return {'success': True}
     except Exception as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to save filters: {e}'}), 500
+        logger.error(f'Error saving filters: {e}', exc_info=True)
+        return error_response(f'Failed to save filters: {e}')
+
+
+def upsert_favorite(conn, session_id, property_id, filters):
+    conn.execute('''
+        INSERT INTO favorites (session_id, property_id, filters, timestamp)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(session_id, property_id) DO UPDATE SET
+            filters = excluded.filters,
+            timestamp = excluded.timestamp
+    ''', (session_id, property_id, filters, int(datetime.now().timestamp())))
+    conn.commit()
+
 
-@app.route('/api/favorites', methods=['POST'])
-def add_favorite():
-    data = request.json
+@app.post('/api/favorites')
+async def add_favorite(request: Request):
+    data = await request.json()
     session_id = data.get('sessionId')
     property_id = data.get('propertyId')
     filters = data.get('filters')
 
     if not session_id or not property_id or not filters:
-        return jsonify({'error': 'Missing required fields'}), 400
+        return error_response('Missing required fields', 400)
 
     try:
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO favorites (session_id, property_id, filters, timestamp)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(session_id, property_id) DO UPDATE SET
-                filters = excluded.filters,
-                timestamp = excluded.timestamp
-        ''', (session_id, property_id, filters, int(datetime.now().timestamp())))
-        conn.commit()
-        return jsonify({'success': True})
+        await run_db(upsert_favorite, session_id, property_id, filters)
+        return {'success': True}
     except Exception as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to save favorite: {e}'}), 500
+        logger.error(f'Error saving favorite: {e}', exc_info=True)
+        return error_response(f'Failed to save favorite: {e}')
 
-@app.route('/api/favorites/<property_id>', methods=['DELETE'])
-def remove_favorite(property_id):
-    session_id = request.args.get('sessionId')
-    if not session_id:
-        return jsonify({'error': 'Session ID required'}), 400
 
-    try:
-        conn = get_db_connection()
-        result = conn.execute('''
-            DELETE FROM favorites
-            WHERE session_id = ? AND property_id = ?
-        ''', (session_id, property_id))
-        conn.commit()
+def delete_favorite(conn, session_id, property_id):
+    result = conn.execute('''
+        DELETE FROM favorites
+        WHERE session_id = ? AND property_id = ?
+    ''', (session_id, property_id))
+    conn.commit()
+    return result.rowcount
 
-        if result.rowcount == 0:
-            return jsonify({'error': 'Favorite not found'}), 404
 
-        return jsonify({'success': True})
+@app.delete('/api/favorites/{property_id}')
+async def remove_favorite(property_id: str, sessionId: str = None):
+    if not sessionId:
+        return error_response('Session ID required', 400)
+
+    try:
+        if await run_db(delete_favorite, sessionId, property_id) == 0:
+            return error_response('Favorite not found', 404)
+
+        return {'success': True}
     except Exception as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to remove favorite: {e}'}), 500
+        logger.error(f'Error removing favorite: {e}', exc_info=True)
+        return error_response(f'Failed to remove favorite: {e}')
 
-@app.route('/api/favorites', methods=['GET'])
-def get_favorites():
-    session_id = request.args.get('sessionId')
-    if not session_id:
-        return jsonify({'error': 'Session ID required'}), 400
 
-    try:
-        conn = get_db_connection()
+def fetch_favorites(conn, session_id, include_properties=False):
+    if not include_properties:
         favorites = conn.execute('''
             SELECT property_id, filters, timestamp
             FROM favorites
             WHERE session_id = ?
             ORDER BY timestamp DESC
         ''', (session_id,)).fetchall()
+    else:
+        # One pass over the (session_id, property_id) unique index, with a
+        # PROP_ID index lookup per favorite for its card fields. The CAST
+        # keeps that lookup indexed on databases whose favorites.property_id
+        # was declared INTEGER (numeric affinity would apply to PROP_ID).
+        card_columns = ', '.join(f'p.{column}' for column in CARD_COLUMNS if column != 'PROP_ID')
+        favorites = conn.execute(f'''
+            SELECT f.property_id, f.filters, f.timestamp,
+                   p.PROP_ID, {card_columns}
+            FROM favorites f
+            LEFT JOIN prop_data p ON p.PROP_ID = CAST(f.property_id AS TEXT)
+            WHERE f.session_id = ?
+            ORDER BY f.timestamp DESC
+        ''', (session_id,)).fetchall()
+
+    formatted = []
+    for fav in favorites:
+        item = {
+            'propertyId': fav['property_id'],
+            'filters': fav['filters'],
+            'timestamp': fav['timestamp']
+        }
+        if include_properties:
+            item['property'] = format_property(fav) if fav['PROP_ID'] is not None else None
+        formatted.append(item)
+    return formatted
+
 
-        formatted = [
-            {
-                'propertyId': fav['property_id'],
-                'filters': fav['filters'],
-                'timestamp': fav['timestamp']
-            }
-            for fav in favorites
-        ]
-        return jsonify(formatted)
+@app.get('/api/favorites')
+async def get_favorites(request: Request, sessionId: str = None, include: str = ''):
+    # include=properties embeds each favorite's property card
+    if not sessionId:
+        return error_response('Session ID required', 400)
+
+    include_properties = 'properties' in include.split(',')
+    try:
+        favorites = await run_db(fetch_favorites, sessionId, include_properties)
+        return json_response(request, favorites)
     except Exception as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to fetch favorites: {e}'}), 500
+        logger.error(f'Error fetching favorites: {e}', exc_info=True)
+        return error_response(f'Failed to fetch favorites: {e}')
+
+
+def fetch_favorite_statuses(conn, session_id, property_ids):
+    favorites = set()
+    for start in range(0, len(property_ids), MAX_IDS_PER_QUERY):
+        chunk = property_ids[start:start + MAX_IDS_PER_QUERY]
+        rows = conn.execute(f'''
+            SELECT property_id
+            FROM favorites
+            WHERE session_id = ?
+              AND property_id IN ({', '.join('?' for _ in chunk)})
+        ''', (session_id, *chunk)).fetchall()
+        favorites.update(str(row['property_id']) for row in rows)
+    return {property_id: property_id in favorites for property_id in property_ids}
+
+
+@app.post('/api/favorites/status')
+async def check_favorites(request: Request):
+    data = await request.json()
+    session_id = data.get('sessionId')
+    property_ids = data.get('propertyIds')
 
-@app.route('/api/favorites/<property_id>', methods=['GET'])
-def check_favorite(property_id):
-    session_id = request.args.get('sessionId')
     if not session_id:
-        return jsonify({'error': 'Session ID required'}), 400
+        return error_response('Session ID required', 400)
+    if not isinstance(property_ids, list):
+        return error_response('propertyIds must be a list', 400)
 
+    property_ids = list(dict.fromkeys(str(pid) for pid in property_ids))
     try:
-        conn = get_db_connection()
-        favorite = conn.execute('''
-            SELECT 1
-            FROM favorites
-            WHERE session_id = ? AND property_id = ?
-        ''', (session_id, property_id)).fetchone()
+        statuses = await run_db(fetch_favorite_statuses, session_id, property_ids)
+        return {'statuses': statuses}
+    except Exception as e:
+        logger.error(f'Error checking favorite statuses: {e}', exc_info=True)
+        return error_response(f'Failed to check favorite statuses: {e}')
+
+
+def is_favorite(conn, session_id, property_id):
+    favorite = conn.execute('''
+        SELECT 1
+        FROM favorites
+        WHERE session_id = ? AND property_id = ?
+    ''', (session_id, property_id)).fetchone()
+    return favorite is not None
+
+
+@app.get('/api/favorites/{property_id}')
+async def check_favorite(property_id: str, sessionId: str = None):
+    if not sessionId:
+        return error_response('Session ID required', 400)
+
+    try:
+        return {'isFavorite': await run_db(is_favorite, sessionId, property_id)}
+    except Exception as e:
+        logger.error(f'Error checking favorite status: {e}', exc_info=True)
+        return error_response(f'Failed to check favorite status: {e}')
+
+
+def fetch_properties(conn, property_ids):
+    return property_cache.get_many(conn, property_ids)
+
+
+async def property_validators():
+    # prop_data only changes when table_create.py runs, so its version stamp
+    # validates every property response without touching the rows. Returns
+    # (None, None) on databases without a stamp; the body hash is used then.
+    version, updated_at = await run_db(property_cache.version_info)
+    if version is None:
+        return None, None
+    return make_etag('prop', version), updated_at
+
+
+@app.get('/api/properties')
+async def get_properties(request: Request, ids: str = ''):
+    property_ids = [pid.strip() for pid in ids.split(',') if pid.strip()]
+    if not property_ids:
+        return error_response('ids required', 400)
+    if len(property_ids) > MAX_BATCH_PROPERTIES:
+        return error_response(f'At most {MAX_BATCH_PROPERTIES} ids per request', 400)
+
+    try:
+        etag, last_modified = await property_validators()
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified, PROPERTY_CACHE_CONTROL)
+
+        cards = await run_db(fetch_properties, property_ids)
+        return json_response(request, {
+            'properties': [cards[pid] for pid in property_ids if pid in cards],
+            'missing': [pid for pid in property_ids if pid not in cards],
+        }, etag, last_modified, PROPERTY_CACHE_CONTROL)
+    except Exception as e:
+        logger.error(f'Error fetching properties: {e}', exc_info=True)
+        return error_response(f'Failed to fetch properties: {e}')
+
+
+def search_builder(conn):
+    # Rebuilt only when table_create.py publishes a new prop_data version
+    global _search_builder
+    version, _ = property_cache.version_info(conn)
+    cached_version, builder = _search_builder
+    if builder is None or cached_version != version:
+        builder = PropertyQueryBuilder.for_connection(conn)
+        _search_builder = (version, builder)
+    return builder
+
+
+def search_properties(conn, text, filters, session_id, limit):
+    if filters is None:
+        filters = filter_store.load_filters(conn, session_id) if session_id else []
+    builder = search_builder(conn)
+    if 'PRICE_VALUE' not in builder.columns:
+        # Databases loaded before numeric prices: budgets use price_value()
+        query_builder.prepare_connection(conn)
+    sql, params = builder.build(filters, columns=CARD_COLUMNS, limit=limit, text=text)
+    return [format_property(row) for row in conn.execute(sql, params)]
+
+
+def parse_filters_param(filters):
+    """Parses a ``filters`` query parameter (a JSON list in the
+    final_text_filters format); None if absent. Raises ValueError."""
+    if not filters:
+        return None
+    try:
+        parsed = json.loads(filters)
+    except json.JSONDecodeError:
+        parsed = None
+    if not isinstance(parsed, list):
+        raise ValueError('filters must be a JSON list')
+    return parsed
+
+
+@app.get('/api/search')
+async def search(request: Request, q: str = '', filters: str = None, sessionId: str = None,
+                 limit: int = SEARCH_PAGE_SIZE):
+    # Free text ranked by BM25 over headings, localities and descriptions,
+    # narrowed by structured filters: ``filters`` or else the session's
+    # current filters.
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    try:
+        parsed_filters = parse_filters_param(filters)
+    except ValueError as e:
+        return error_response(str(e), 400)
 
-        is_favorite = favorite is not None
-        return jsonify({'isFavorite': is_favorite})
+    try:
+        properties = await run_db(search_properties, q, parsed_filters, sessionId, limit)
+        return json_response(request, {'properties': properties})
     except Exception as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to check favorite status: {e}'}), 500
+        logger.error(f'Error searching properties: {e}', exc_info=True)
+        return error_response(f'Failed to search properties: {e}')
+
+
+def fetch_facet_counts(conn, filters, session_id):
+    if filters is None:
+        filters = filter_store.load_filters(conn, session_id) if session_id else []
+    version, _ = property_cache.version_info(conn)
+    key = (version, facet_counts.conditions(filters))
+    with _facet_cache_lock:
+        cached = _facet_cache.get(key)
+        if cached is not None:
+            _facet_cache.move_to_end(key)
+            return key, cached
+    counts = facet_counts.counts(conn, filters)
+    with _facet_cache_lock:
+        _facet_cache[key] = counts
+        while len(_facet_cache) > FACET_CACHE_SIZE:
+            _facet_cache.popitem(last=False)
+    return key, counts
+
+
+@app.get('/api/facets')
+async def get_facets(request: Request, filters: str = None, sessionId: str = None):
+    # Listing counts per filter option, from the facet_counts table
+    # table_create.py maintains. Counts follow the CITY and TRANSACT_TYPE of
+    # ``filters`` (or the session's current filters).
+    try:
+        parsed_filters = parse_filters_param(filters)
+    except ValueError as e:
+        return error_response(str(e), 400)
 
-@app.route('/api/properties/<property_id>', methods=['GET'])
-def get_property_details(property_id):
     try:
-        conn = get_db_connection()
-        property = conn.execute('''
-            SELECT
-                PRICE,
-                PHOTO_URL,
-                PROP_HEADING,
-                BEDROOM_NUM,
-                BATHROOM_NUM,
-                PROPERTY_TYPE,
-                LOCALITY,
-                BUILTUP_SQFT,
-                PROP_ID
-            FROM prop_data
-            WHERE PROP_ID = ?
-        ''', (property_id,)).fetchone()
+        key, counts = await run_db(fetch_facet_counts, parsed_filters, sessionId)
+        etag = content_etag(json.dumps(['facets', *key]).encode())
+        if is_not_modified(request, etag):
+            return not_modified_response(etag, cache_control=FACETS_CACHE_CONTROL)
+        return json_response(request, {'facets': counts}, etag, cache_control=FACETS_CACHE_CONTROL)
+    except Exception as e:
+        logger.error(f'Error fetching facet counts: {e}', exc_info=True)
+        return error_response(f'Failed to fetch facet counts: {e}')
+
+
+def facet_index(conn):
+    # Retried while table_create.py hasn't built facet_bitmaps for this version
+    global _facet_index
+    version, _ = property_cache.version_info(conn)
+    with _facet_index_lock:
+        cached_version, index = _facet_index
+        if index is None or cached_version != version:
+            index = facet_bitmaps.load(conn)
+            _facet_index = (version, index)
+    return index
+
+
+def count_matches(conn, filters, session_id):
+    if filters is None:
+        filters = filter_store.load_filters(conn, session_id) if session_id else []
+    index = facet_index(conn)
+    rowids, estimate = None, None
+    if index is not None:
+        bitmap_query, complete = index.query_for_filters(filters)
+        estimate = index.estimate(bitmap_query)
+        bits = index.evaluate(bitmap_query)
+        if complete or not bits:
+            return {'count': bits.bit_count(), 'estimate': estimate}
+        rowids = index.rowids_of(bits) if bits.bit_count() <= MAX_COUNT_CANDIDATES else None
+
+    builder = search_builder(conn)
+    if 'PRICE_VALUE' not in builder.columns:
+        query_builder.prepare_connection(conn)
+    where, params = builder.where(filters, rowids)
+    count = conn.execute(f'SELECT COUNT(*) FROM prop_data WHERE {where}', params).fetchone()[0]
+    return {'count': count, 'estimate': estimate}
+
+
+@app.get('/api/facets/count')
+async def get_match_count(request: Request, filters: str = None, sessionId: str = None):
+    # Number of listings matching ``filters`` (or the session's current
+    # filters), for "Show 123 properties". Facet filters are counted on the
+    # facet_bitmaps index; ``estimate`` is its independence-based guess,
+    # null without the index. KEYWORDS are not counted.
+    try:
+        parsed_filters = parse_filters_param(filters)
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    try:
+        result = await run_db(count_matches, parsed_filters, sessionId)
+        return json_response(request, result)
+    except Exception as e:
+        logger.error(f'Error counting properties: {e}', exc_info=True)
+        return error_response(f'Failed to count properties: {e}')
+
 
+@app.get('/api/properties/{property_id}')
+async def get_property_details(property_id: str, request: Request):
+    try:
+        etag, last_modified = await property_validators()
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified, PROPERTY_CACHE_CONTROL)
+
+        property = (await run_db(fetch_properties, [property_id])).get(property_id)
         if not property:
-            return jsonify({'error': 'Property not found'}), 404
-
-        formatted_property = {
-            'id': property['PROP_ID'],
-            'title': property['PROP_HEADING'],
-            'price': property['PRICE'],
-            'address': property['LOCALITY'],
-            'bedrooms': property['BEDROOM_NUM'],
-            'bathrooms': property['BATHROOM_NUM'],
-            'area': f"{property['BUILTUP_SQFT']} sqft",
-            'type': property['PROPERTY_TYPE'],
-            'description': 'No description available',
-            'images': [property['PHOTO_URL']] if property['PHOTO_URL'] else ['https://via.placeholder.com/800x600?text=No+Image+Available'],
-            'amenities': ['Not specified'],
-            'agent': {
-                'name': 'Unknown Agent',
-                'phone': 'Not available',
-                'email': 'no-email@example.com',
-                'avatar': 'https://via.placeholder.com/150?text=Agent',
-                'title': 'Real Estate Agent'
-            }
+            return error_response('Property not found', 404)
+
+        return json_response(request, property, etag, last_modified, PROPERTY_CACHE_CONTROL)
+    except Exception as e:
+        logger.error(f'Error fetching property details: {e}', exc_info=True)
+        return error_response(f'Failed to fetch property details: {e}')
+
+
+def fetch_session_bootstrap(conn, sender_id, conversation_limit):
+    # A read transaction pins one WAL snapshot, so the tracker store can't
+    # commit between the conversation and filter reads.
+    conn.execute('BEGIN')
+    try:
+        return {
+            'sessionId': sender_id,
+            'conversation': fetch_conversation(conn, sender_id, limit=conversation_limit),
+            'filters': fetch_filters(conn, sender_id),
+            'favorites': fetch_favorites(conn, sender_id, include_properties=True),
         }
-        return jsonify(formatted_property)
+    finally:
+        conn.rollback()
+
+
+@app.get('/api/sessions/{sender_id}/bootstrap')
+async def get_session_bootstrap(sender_id: str, request: Request,
+                                limit: int = BOOTSTRAP_CONVERSATION_LIMIT):
+    """Everything the UI needs to open a session, in one round trip."""
+    limit = max(1, min(limit, MAX_CONVERSATION_PAGE))
+    try:
+        bootstrap = await run_db(fetch_session_bootstrap, sender_id, limit)
+        return json_response(request, bootstrap)
     except Exception as e:
-        app.logger.error(f'Error fetching sessions: {e}', exc_info=True)
-        return jsonify({'error': f'Failed to fetch property details: {e}'}), 500
+        logger.error(f'Error bootstrapping session: {e}', exc_info=True)
+        return error_response(f'Failed to bootstrap session: {e}')
+
+
+@app.get('/api/pool-stats')
+async def get_pool_stats():
+    return {**db_pool.stats(), 'property_cache': property_cache.stats()}
+
 
 if __name__ == '__main__':
-    app.run(port=5055, debug=True)
+    uvicorn.run(
+        'server:app',
+        host='0.0.0.0',
+        port=5055,
+        workers=int(os.environ.get('API_WORKERS', 4)),
+    )
@@ -1,9 +1,307 @@
+import argparse
+import hashlib
 import pandas as pd
 import sqlite3
 from pathlib import Path
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def create_database():
+import db_indexes
+from realstate_bot_calm.actions import facet_bitmaps, facet_counts, prop_snapshot, text_search
+from realstate_bot_calm.actions.query_builder import parse_area, parse_price_range
+
+NUMERIC_COLUMNS = ["PRICE_VALUE", "PRICE_MAX_VALUE", "AREA_VALUE"]
+DEFAULT_CHUNKSIZE = 20000
+
+# Only for the duration of the load: a crash mid-ingest means re-running it
+BULK_LOAD_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "cache_size": -200000,
+    "temp_store": "MEMORY",
+}
+
+FACET_FILES = {
+    "facets_building_id": "BUILDING_ID.csv",
+    "facets_total_floor": "TOTAL_FLOOR.csv",
+    "facets_ownership_type": "OWNERSHIP_TYPE.csv",
+    "facets_age": "AGE.csv",
+    "facets_furnish": "FURNISH.csv",
+    "facets_amenities": "AMENITIES.csv",
+    "facets_floor_num": "FLOOR_NUM.csv",
+    "facets_bathroom_num": "BATHROOM_NUM.csv",
+    "facets_property_type": "PROPERTY_TYPE.csv",
+    "facets_sub_availability": "SUB_AVAILABILITY.csv",
+    "facets_facing_direction": "FACING_DIRECTION.csv",
+    "facets_city": "CITY.csv",
+    "facets_features": "FEATURES.csv",
+    "facets_bedroom_num": "BEDROOM_NUM.csv",
+    "facets_locality_id": "LOCALITY_ID.csv",
+}
+
+META_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS data_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        updated_at FLOAT
+    )""",
+    # What each city's rows in prop_data were loaded from
+    """
+    CREATE TABLE IF NOT EXISTS ingest_files (
+        source_city TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        row_count INTEGER,
+        loaded_at FLOAT
+    )""",
+]
+
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def add_numeric_columns(df):
+    """Adds PRICE_VALUE / PRICE_MAX_VALUE (rupees) and AREA_VALUE (sq. ft.)
+    parsed from the text columns; unparseable values such as
+    "Price on Request" become NULL."""
+    if "PRICE" in df.columns:
+        prices = df["PRICE"].map(parse_price_range)
+        df["PRICE_VALUE"] = pd.to_numeric(prices.str[0], errors="coerce")
+        df["PRICE_MAX_VALUE"] = pd.to_numeric(prices.str[1], errors="coerce")
+    if "BUILTUP_SQFT" in df.columns:
+        df["AREA_VALUE"] = pd.to_numeric(df["BUILTUP_SQFT"].map(parse_area), errors="coerce")
+    return df
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ensure_meta_tables(conn):
+    for sql in META_TABLES:
+        conn.execute(sql)
+    conn.commit()
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({quote(table)})")]
+
+
+def record_ingest(conn, city, file_path, sha256, rows):
+    conn.execute("""
+        INSERT INTO ingest_files (source_city, path, sha256, row_count, loaded_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(source_city) DO UPDATE SET
+            path = excluded.path, sha256 = excluded.sha256,
+            row_count = excluded.row_count, loaded_at = excluded.loaded_at
+    """, (city, str(file_path), sha256, rows, time.time()))
+
+
+def bump_data_version(conn):
+    """Increments ``prop_data_version`` in data_meta, which the API's
+    property cache and the action server's query builder watch."""
+    row = conn.execute("SELECT value FROM data_meta WHERE key = 'prop_data_version'").fetchone()
+    try:
+        version = int(float(row[0])) + 1 if row else 1
+    except (TypeError, ValueError):
+        version = 1
+    conn.execute("""
+        INSERT INTO data_meta (key, value, updated_at) VALUES ('prop_data_version', ?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    """, (str(version), time.time()))
+    return version
+
+
+def normalize_columns(df):
+    df.columns = [str(column).strip() for column in df.columns]
+    if "city" in df.columns:
+        df.rename(columns={"city": "original_city"}, inplace=True)
+    return df
+
+
+def prop_data_columns(csv_files):
+    """Union of the city files' columns, in first-seen order, read from the
+    headers only."""
+    columns = {}
+    for file_path in csv_files.values():
+        header = normalize_columns(pd.read_csv(file_path, nrows=0))
+        columns.update(dict.fromkeys(header.columns))
+    columns.update(dict.fromkeys(["source_city", *NUMERIC_COLUMNS]))
+    return list(columns)
+
+
+def load_prop_data_in_memory(conn, csv_files, hashes):
+    # Every city in one DataFrame; memory grows with the total row count.
+    # Always a full rebuild.
+    dfs = {}
+    for city, file_path in csv_files.items():
+        try:
+            df = normalize_columns(pd.read_csv(file_path))
+            df["source_city"] = city
+            dfs[city] = df
+            print(f"✓ Data loaded from {file_path.name}")
+        except Exception as e:
+            print(f"⚠ Error processing {file_path.name}: {str(e)}")
+    if not dfs:
+        return 0
+
+    combined_df = add_numeric_columns(pd.concat(dfs.values(), ignore_index=True))
+    combined_df.to_sql(
+        "prop_data", conn, if_exists="replace", index=False,
+        dtype={column: "REAL" for column in NUMERIC_COLUMNS},
+    )
+    priced = int(combined_df["PRICE_VALUE"].notna().sum()) if "PRICE_VALUE" in combined_df else 0
+    print(f"✓ Parsed numeric prices for {priced} of {len(combined_df)} listings")
+    with conn:
+        conn.execute("DELETE FROM ingest_files")
+        for city, df in dfs.items():
+            record_ingest(conn, city, csv_files[city], hashes[city], len(df))
+        text_search.build_index(conn)
+        bump_data_version(conn)
+    return list(dfs)
+
+
+def prepare_chunk(df, city):
+    df = normalize_columns(df)
+    df["source_city"] = city
+    return add_numeric_columns(df)
+
+
+def parse_city_file(city, file_path):
+    """Process-pool worker: one whole city file, parsed and normalized."""
+    start = time.perf_counter()
+    df = prepare_chunk(pd.read_csv(file_path), city)
+    return city, df, time.perf_counter() - start
+
+
+def parse_facet_file(table_name, file_path):
+    start = time.perf_counter()
+    df = pd.read_csv(file_path)
+    return table_name, df, time.perf_counter() - start
+
+
+def insert_rows(conn, columns, df):
+    # Missing columns become NULL; object dtype turns numpy scalars and NaN
+    # into values sqlite3 can bind.
+    df = df.reindex(columns=columns).astype(object)
+    df = df.where(df.notna(), None)
+    conn.executemany(
+        f"INSERT INTO prop_data ({', '.join(quote(c) for c in columns)}) "
+        f"VALUES ({', '.join('?' for _ in columns)})",
+        df.itertuples(index=False, name=None),
+    )
+    return len(df)
+
+
+def load_prop_data_streaming(conn, csv_files, hashes, chunksize=DEFAULT_CHUNKSIZE, full=False, executor=None):
+    """Loads city files ``chunksize`` rows at a time, in one transaction.
+
+    Only cities whose file hash differs from ``ingest_files`` are reloaded
+    (their rows deleted by ``source_city`` and re-inserted), unless ``full``
+    or prop_data doesn't exist yet; cities in ``ingest_files`` that are no
+    longer in ``csv_files`` have their rows removed. Readers keep seeing the
+    previous rows until the transaction commits. Returns the cities that
+    were loaded.
+
+    With an ``executor``, whole files are parsed concurrently in worker
+    processes and this connection stays the only writer, inserting each city
+    as its parse finishes; memory then holds up to one parsed file per worker.
+    """
+    existing = table_columns(conn, "prop_data")
+    rebuild = full or not existing
+    departed = []
+    if rebuild:
+        cities = list(csv_files)
+    else:
+        stored = dict(conn.execute("SELECT source_city, sha256 FROM ingest_files"))
+        cities = [city for city in csv_files if stored.get(city) != hashes[city]]
+        for city in csv_files:
+            if city not in cities:
+                print(f"• {csv_files[city].name}: unchanged, skipped")
+        # prop_data mirrors csv_files, so a city whose file is gone goes too
+        departed = [city for city in stored if city not in csv_files]
+        for city in departed:
+            print(f"⚠ {city}: no data file any more, its rows will be removed")
+    if not cities and not departed:
+        return []
+
+    # Only one chunk is held in memory at a time; the table's columns are
+    # the union of all city headers, so cities missing a column get NULLs.
+    columns = prop_data_columns({city: csv_files[city] for city in cities})
+    if not rebuild:
+        columns = existing + [c for c in columns if c not in existing]
+
+    if executor is None:
+        sources = (
+            (city, (prepare_chunk(chunk, city) for chunk in pd.read_csv(csv_files[city], chunksize=chunksize)), None)
+            for city in cities
+        )
+    else:
+        futures = [executor.submit(parse_city_file, city, csv_files[city]) for city in cities]
+        sources = (
+            (city, [df], parse_seconds)
+            for city, df, parse_seconds in (future.result() for future in as_completed(futures))
+        )
+
+    conn.commit()
+    for pragma, value in BULK_LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+    conn.execute("BEGIN")
+    try:
+        if rebuild:
+            conn.execute("DROP TABLE IF EXISTS prop_data")
+            conn.execute("DELETE FROM ingest_files")
+            column_defs = ", ".join(
+                f"{quote(c)} REAL" if c in NUMERIC_COLUMNS else quote(c) for c in columns
+            )
+            conn.execute(f"CREATE TABLE prop_data ({column_defs})")
+        else:
+            for column in columns[len(existing):]:
+                column_type = " REAL" if column in NUMERIC_COLUMNS else ""
+                conn.execute(f"ALTER TABLE prop_data ADD COLUMN {quote(column)}{column_type}")
+
+        for city in departed:
+            removed = conn.execute("DELETE FROM prop_data WHERE source_city = ?", (city,)).rowcount
+            conn.execute("DELETE FROM ingest_files WHERE source_city = ?", (city,))
+            print(f"✓ {city}: {removed} rows removed")
+
+        for city, frames, parse_seconds in sources:
+            file_path = csv_files[city]
+            start, rows = time.perf_counter(), 0
+            if not rebuild:
+                conn.execute("DELETE FROM prop_data WHERE source_city = ?", (city,))
+            for frame in frames:
+                rows += insert_rows(conn, columns, frame)
+            record_ingest(conn, city, file_path, hashes[city], rows)
+            elapsed = time.perf_counter() - start
+            if parse_seconds is None:
+                print(f"✓ {file_path.name}: {rows} rows streamed in {elapsed:.1f}s")
+            else:
+                print(f"✓ {file_path.name}: {rows} rows parsed in {parse_seconds:.1f}s, written in {elapsed:.1f}s")
+
+        # prop_fts points at rowids, which the reload just changed
+        fts_columns = text_search.build_index(conn)
+        version = bump_data_version(conn)
+        conn.commit()
+        print(f"✓ Full-text index over {', '.join(fts_columns) or 'no columns'}")
+        print(f"✓ prop_data version {version}")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return cities
+
+
+def create_database(mode="stream", chunksize=DEFAULT_CHUNKSIZE, full=False, workers=None):
     # Database path - using absolute path in user's home directory
     db_dir = os.path.expanduser("~/.rasa_data")  # Creates directory in user's home
     os.makedirs(db_dir, exist_ok=True)
@@ -19,6 +317,9 @@ def create_database():
         except Exception as e:
             print(f"Error deleting old database: {e}")
     
+    started = time.perf_counter()
+    # Parsing fans out to worker processes; this process does every write
+    executor = ProcessPoolExecutor(max_workers=workers) if mode == "parallel" else None
     try:
         # Connect to the SQLite database
         conn = sqlite3.connect(db_path)
@@ -37,62 +338,48 @@ def create_database():
             "gurgaon": data_dir / "gurgaon_10k.csv",
         }
         
-        dfs = []
-        missing_files = []
-        
-        for city, file_path in csv_files.items():
-            if not file_path.exists():
-                missing_files.append(str(file_path))
-                continue
-                
-            try:
-                df = pd.read_csv(file_path)
-                
-                if "city" in df.columns:
-                    df.rename(columns={"city": "original_city"}, inplace=True)
-                
-                df["source_city"] = city
-                dfs.append(df)
-                print(f"✓ Data loaded from {file_path.name}")
-            except Exception as e:
-                print(f"⚠ Error processing {file_path.name}: {str(e)}")
-        
+        missing_files = [str(path) for path in csv_files.values() if not path.exists()]
+        csv_files = {city: path for city, path in csv_files.items() if path.exists()}
         if missing_files:
             print(f"\nMissing data files: {', '.join(missing_files)}")
-        
-        if dfs:
-            combined_df = pd.concat(dfs, ignore_index=True)
-            combined_df.to_sql("prop_data", conn, if_exists="replace", index=False)
-            print("\n✅ Main property table created with", len(combined_df), "records")
+
+        facet_dir = data_dir / "facets/facets"
+        facet_futures = {}
+        if executor is not None and facet_dir.exists():
+            facet_futures = {
+                table_name: executor.submit(parse_facet_file, table_name, facet_dir / filename)
+                for table_name, filename in FACET_FILES.items()
+                if (facet_dir / filename).exists()
+            }
+
+        ensure_meta_tables(conn)
+        hashes = {city: file_hash(path) for city, path in csv_files.items()}
+        if mode == "memory":
+            loaded = load_prop_data_in_memory(conn, csv_files, hashes)
+        else:
+            loaded = load_prop_data_streaming(conn, csv_files, hashes, chunksize, full=full, executor=executor)
+
+        total = conn.execute("SELECT COUNT(*) FROM prop_data").fetchone()[0] if table_columns(conn, "prop_data") else 0
+        if total and not loaded and not text_search.index_columns(conn):
+            with conn:
+                text_search.build_index(conn)
+            print("✓ Full-text index built")
+
+        if total:
+            if loaded:
+                print(f"\n✅ Main property table has {total} records ({', '.join(loaded)} reloaded)")
+            else:
+                print(f"\n✅ Main property table unchanged ({total} records)")
         else:
             print("\n❌ No property data processed - check your CSV files")
             return False
 
         # Load and create facet tables
-        facet_dir = data_dir / "facets/facets"
         if not facet_dir.exists():
             raise FileNotFoundError(f"Facets directory not found at: {facet_dir}")
 
-        facet_files = {
-            "facets_building_id": "BUILDING_ID.csv",
-            "facets_total_floor": "TOTAL_FLOOR.csv",
-            "facets_ownership_type": "OWNERSHIP_TYPE.csv",
-            "facets_age": "AGE.csv",
-            "facets_furnish": "FURNISH.csv",
-            "facets_amenities": "AMENITIES.csv",
-            "facets_floor_num": "FLOOR_NUM.csv",
-            "facets_bathroom_num": "BATHROOM_NUM.csv",
-            "facets_property_type": "PROPERTY_TYPE.csv",
-            "facets_sub_availability": "SUB_AVAILABILITY.csv",
-            "facets_facing_direction": "FACING_DIRECTION.csv",
-            "facets_city": "CITY.csv",
-            "facets_features": "FEATURES.csv",
-            "facets_bedroom_num": "BEDROOM_NUM.csv",
-            "facets_locality_id": "LOCALITY_ID.csv",
-        }
-        
         facet_errors = 0
-        for table_name, filename in facet_files.items():
+        for table_name, filename in FACET_FILES.items():
             file_path = facet_dir / filename
             if not file_path.exists():
                 print(f"⚠ Missing facet: {filename}")
@@ -100,15 +387,34 @@ def create_database():
                 continue
                 
             try:
-                df = pd.read_csv(file_path)
+                if table_name in facet_futures:
+                    _, df, parse_seconds = facet_futures[table_name].result()
+                else:
+                    _, df, parse_seconds = parse_facet_file(table_name, file_path)
+                start = time.perf_counter()
                 df.to_sql(table_name, conn, if_exists="replace", index=False)
-                print(f"✓ {table_name.ljust(25)} ({len(df)} records)")
+                print(f"✓ {table_name.ljust(25)} ({len(df)} records, parsed in {parse_seconds:.2f}s, "
+                      f"written in {time.perf_counter() - start:.2f}s)")
             except Exception as e:
                 print(f"⚠ Error processing {filename}: {str(e)}")
                 facet_errors += 1
         
         print(f"\nFacets loaded with {facet_errors} errors")
 
+        # Filter-panel counts for the cities reloaded above (every city on the first build)
+        with conn:
+            written = facet_counts.refresh(conn, loaded if facet_counts.is_built(conn) else None)
+        print(f"✓ Facet counts refreshed ({written} rows)")
+
+        # Bitmap per facet value, for the action server's filter evaluation
+        with conn:
+            if facet_bitmaps.is_current(conn):
+                print("✓ Facet bitmaps up to date")
+            else:
+                version = conn.execute("SELECT value FROM data_meta WHERE key = 'prop_data_version'").fetchone()[0]
+                written = facet_bitmaps.build(conn, version)
+                print(f"✓ Facet bitmaps rebuilt ({written} bitmaps, version {version})")
+
         # Create application tables
         tables = {
             "saved_preferences": """
@@ -121,12 +427,20 @@ def create_database():
                 action_name VARCHAR(255),
                 data TEXT
             )""",
+
+            "current_filters": """
+            CREATE TABLE IF NOT EXISTS current_filters (
+                sender_id TEXT PRIMARY KEY,
+                filters TEXT NOT NULL,
+                filled_by TEXT,
+                updated_at FLOAT NOT NULL
+            )""",
             
             "favorites": """
             CREATE TABLE IF NOT EXISTS favorites (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 session_id VARCHAR(255) NOT NULL,
-                property_id INTEGER NOT NULL,
+                property_id TEXT NOT NULL,
                 filters TEXT,
                 timestamp FLOAT,
                 UNIQUE(session_id, property_id)
@@ -142,7 +456,7 @@ def create_database():
                 visit_time TEXT,
                 status TEXT DEFAULT 'active',
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )"""
+            )""",
         }
 
         for name, sql in tables.items():
@@ -154,17 +468,49 @@ def create_database():
 
         # Commit changes
         conn.commit()
-        print("\nDatabase setup completed successfully.")
+
+        # to_sql(if_exists="replace") dropped any indexes on the reloaded tables
+        created = db_indexes.create_indexes(conn)
+        print(f"\n✅ {len(created)} indexes in place")
+        db_indexes.analyze(conn)
+
+        # Columnar copy of prop_data for bulk scans and analytics
+        version = conn.execute("SELECT value FROM data_meta WHERE key = 'prop_data_version'").fetchone()[0]
+        snapshot = prop_snapshot.snapshot_path(db_path)
+        if not prop_snapshot.available():
+            print("\n• pyarrow not installed - columnar snapshot skipped")
+        elif prop_snapshot.snapshot_version(snapshot) != version:
+            rows = prop_snapshot.write_snapshot(conn, snapshot, version)
+            print(f"\n✅ Columnar snapshot written to {snapshot} ({rows} rows, version {version})")
+
+        # Last, so a failing plan check never skips an ingest step
+        if not db_indexes.print_report(db_indexes.explain_report(conn)):
+            print("\n❌ Data loaded, but hot queries are not covered by indexes - see db_indexes.py")
+            return False
+
+        print(f"\nDatabase setup completed successfully in {time.perf_counter() - started:.1f}s.")
         return True
         
     except Exception as e:
         print(f"\n❌ Critical error: {str(e)}")
         return False
     finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
         if 'conn' in locals():
             conn.close()
 
 if __name__ == "__main__":
-    success = create_database()
+    parser = argparse.ArgumentParser(description="Build the bot database from the CSV dumps")
+    parser.add_argument("--mode", choices=["stream", "parallel", "memory"], default="stream",
+                        help="stream: chunked, flat memory (default); parallel: parse files in "
+                             "worker processes, one writer; memory: load each city whole")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes for --mode parallel (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--full", action="store_true",
+                        help="reload every city even if its file hash is unchanged")
+    args = parser.parse_args()
+    success = create_database(mode=args.mode, chunksize=args.chunksize, full=args.full, workers=args.workers)
     if not success:
         exit(1)
\ No newline at end of file